@@ -40,6 +40,7 @@ function(calculate_offsets target_name source outfile)
 			"${CMAKE_CURRENT_BINARY_DIR}/${target_name}.d"
 		DEPENDS
 			"${CMAKE_SOURCE_DIR}/scripts/calculate-offsets.py"
+			"${CMAKE_SOURCE_DIR}/scripts/anillo_util.py"
 			"${CALC_OFFSETS_source_real}"
 		VERBATIM
 		COMMAND_EXPAND_LISTS
@@ -35,9 +35,12 @@ function(spooky_gen target_name rpc_def_path)
 			"${SPOOKY_GEN_SOURCE}"
 			"-H"
 			"${SPOOKY_GEN_HEADER}"
+			"-c"
+			"${CMAKE_CURRENT_BINARY_DIR}/spookygen-cache"
 			"${SPOOKY_GEN_SERVER_ARG}"
 		DEPENDS
 			"${CMAKE_SOURCE_DIR}/libspooky/scripts/spookygen.py"
+			"${CMAKE_SOURCE_DIR}/scripts/anillo_util.py"
 			"${SPOOKY_GEN_RPC_DEF_PATH}"
 		WORKING_DIRECTORY "${CMAKE_CURRENT_SOURCE_DIR}"
 	)
@@ -7,8 +7,6 @@ import re
 import json
 import io
 import sys
-import tempfile
-import hashlib
 
 SCRIPT_DIR = os.path.dirname(__file__)
 SOURCE_ROOT = os.path.join(SCRIPT_DIR, '..', '..')
@@ -16,22 +14,9 @@ SOURCE_ROOT = os.path.join(SCRIPT_DIR, '..', '..')
 sys.path.append(os.path.join(SOURCE_ROOT, 'scripts'))
 import anillo_util
 
-if len(sys.argv) != 6:
-	print('Usage: ' + sys.argv[0] + ' <architecture> <build-dir> <output-header> <output-json> <output-depfile>')
-	sys.exit(1)
-
-ARCH = sys.argv[1]
-BUILD_DIR = sys.argv[2]
-OUTPUT_HEADER_PATH = sys.argv[3]
-OUTPUT_JSON_PATH = sys.argv[4]
-OUTPUT_DEPFILE_PATH = sys.argv[5]
-
 KERNEL_SOURCE_ROOT = os.path.join(SOURCE_ROOT, 'kernel')
 HEADER_GUARD_NAME = '_GEN_FERRO_OFFSETS_H'
 
-offsets_tmp_path = os.path.join(BUILD_DIR, 'offsets.c')
-object_tmp_path = os.path.join(BUILD_DIR, 'offsets.o')
-
 HEADERS_COMMON = [
 	'ferro/core/interrupts.h',
 	'ferro/core/threads.h',
@@ -75,118 +60,139 @@ STRUCTS_PER_ARCH = {
 	],
 }
 
-data = {}
-defs = ''
-tmp_index = 0
+STRUCT_NAME_REGEX = re.compile(r'struct ([A-Za-z0-9_]+)')
+TOTAL_REGEX = re.compile(r'sizeof=([0-9]+).*?\balign=([0-9]+)')
+MEMBER_REGEX = re.compile(r'^\s*([0-9]+)\b.*?([A-Za-z0-9_]+)$')
 
-anillo_util.mkdir_p(os.path.dirname(offsets_tmp_path))
+def main():
+	if len(sys.argv) != 6:
+		print('Usage: ' + sys.argv[0] + ' <architecture> <build-dir> <output-header> <output-json> <output-depfile>')
+		sys.exit(1)
 
-with io.open(offsets_tmp_path, 'w', newline='\n') as tmpfile:
-	for header in HEADERS_COMMON + HEADERS_PER_ARCH[ARCH]:
-		tmpfile.write('#include <' + header + '>\n')
+	arch = sys.argv[1]
+	build_dir = sys.argv[2]
+	output_header_path = sys.argv[3]
+	output_json_path = sys.argv[4]
+	output_depfile_path = sys.argv[5]
 
-	tmpfile.write('\n')
+	offsets_tmp_path = os.path.join(build_dir, 'offsets.c')
+	depfile_tmp_path = os.path.join(build_dir, 'offsets.d.tmp')
+	cache_key_path = output_header_path + '.key'
 
-	for struct in STRUCTS_COMMON + STRUCTS_PER_ARCH[ARCH]:
-		tmpfile.write('struct ' + struct + ' tmp' + str(tmp_index) + ';\n')
-		tmp_index = tmp_index + 1
+	data = {}
+	tmp_index = 0
 
-headers_result = subprocess.run(['clang', '-ffreestanding', '-nostdlib', '-target', ARCH + '-unknown-none-macho', '-I', os.path.join(KERNEL_SOURCE_ROOT, 'include'), '-I', os.path.join(KERNEL_SOURCE_ROOT, 'kernel-include'), offsets_tmp_path, '-M'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+	anillo_util.mkdir_p(os.path.dirname(offsets_tmp_path))
 
-headers_result.check_returncode()
+	with io.open(offsets_tmp_path, 'w', newline='\n') as tmpfile:
+		for header in HEADERS_COMMON + HEADERS_PER_ARCH[arch]:
+			tmpfile.write('#include <' + header + '>\n')
 
-dep_headers = headers_result.stdout.decode().strip()
+		tmpfile.write('\n')
 
-write_depfile = False
+		for struct in STRUCTS_COMMON + STRUCTS_PER_ARCH[arch]:
+			# evaluating `sizeof` forces clang to lay out the structure (and thus dump its layout) even though we never generate code
+			tmpfile.write('char tmp' + str(tmp_index) + '[sizeof(struct ' + struct + ')];\n')
+			tmp_index = tmp_index + 1
 
-if os.path.exists(OUTPUT_DEPFILE_PATH):
-	with io.open(OUTPUT_DEPFILE_PATH, 'r', newline='\n') as outfile:
-		file_content = outfile.read().strip()
-		if hashlib.sha256(dep_headers.encode()).hexdigest() != hashlib.sha256(file_content.encode()).hexdigest():
-			write_depfile = True
-else:
-	write_depfile = True
+	compiler_flags = ['-ffreestanding', '-nostdlib', '-target', arch + '-unknown-none-macho', '-I', os.path.join(KERNEL_SOURCE_ROOT, 'include'), '-I', os.path.join(KERNEL_SOURCE_ROOT, 'kernel-include')]
 
-if write_depfile:
-	with io.open(OUTPUT_DEPFILE_PATH, 'w', newline='\n') as outfile:
-		outfile.write(dep_headers)
+	cache_command = ['clang', *compiler_flags]
+	# this script and `anillo_util` determine how the layout dump is turned into the outputs, so they're inputs too
+	cache_inputs = [offsets_tmp_path, os.path.abspath(__file__), anillo_util.__file__]
 
-result = subprocess.run(['clang', '-Xclang', '-fdump-record-layouts', '-ffreestanding', '-nostdlib', '-target', ARCH + '-unknown-none-macho', '-I', os.path.join(KERNEL_SOURCE_ROOT, 'include'), '-I', os.path.join(KERNEL_SOURCE_ROOT, 'kernel-include'), '-c', '-o', object_tmp_path, offsets_tmp_path, '-emit-llvm'], stdout=subprocess.PIPE)
+	# the clang invocation below is by far the most expensive part of this script, so skip it entirely
+	# if nothing that went into the previous run has changed
+	if anillo_util.outputs_up_to_date(cache_key_path, cache_command, cache_inputs, output_depfile_path, [output_header_path, output_json_path, output_depfile_path]):
+		return
 
-result.check_returncode()
+	# generate the dependency list in the same invocation that dumps the record layouts
+	result = subprocess.run(['clang', '-Xclang', '-fdump-record-layouts', *compiler_flags, '-MD', '-MF', depfile_tmp_path, '-MT', 'offsets.o', '-fsyntax-only', offsets_tmp_path], stdout=subprocess.PIPE)
 
-entries = [x.group() for x in re.finditer(r'\*\*\* Dumping AST Record Layout\n([^\n]|\n(?!\n))*', result.stdout.decode())]
+	result.check_returncode()
 
-for entry in entries:
-	lines = entry.splitlines()
-	info = {}
+	with io.open(depfile_tmp_path, 'r', newline='\n') as infile:
+		anillo_util.write_if_changed(output_depfile_path, infile.read().strip())
 
-	# remove the first line
-	del lines[0]
+	# split the dump into entries; each one starts with a marker line and ends at the next blank line
+	entries = []
+	entry = None
 
-	# pop important lines
-	name_line = lines.pop(0)
-	total_line = lines.pop(-1)
+	for line in result.stdout.decode().splitlines():
+		if line.startswith('*** Dumping AST Record Layout'):
+			entry = []
+			entries.append(entry)
+		elif entry != None:
+			if len(line) == 0:
+				entry = None
+			else:
+				entry.append(line)
 
-	# find the name
-	try:
-		struct = re.findall(r'struct ([A-Za-z0-9_]+)', name_line)[0]
-	except IndexError:
-		continue
+	for lines in entries:
+		info = {}
 
-	info['size'] = re.findall(r'sizeof=([0-9]+)', total_line)[0]
-	info['alignment'] = re.findall(r'align=([0-9]+)', total_line)[0]
-	info['layout'] = {}
-
-	# parse the layout
-	for line in lines:
-		try:
-			offset = re.findall(r'^\s*([0-9]+)', line)[0]
-		except IndexError:
+		if len(lines) < 2:
 			continue
 
+		# pop important lines
+		name_line = lines.pop(0)
+		total_line = lines.pop(-1)
+
+		# find the name
 		try:
-			member = re.findall(r'([A-Za-z0-9_]+)$', line)[0]
+			struct = STRUCT_NAME_REGEX.findall(name_line)[0]
 		except IndexError:
 			continue
 
-		info['layout'][member] = offset
+		total = TOTAL_REGEX.search(total_line)
+		info['size'] = total.group(1)
+		info['alignment'] = total.group(2)
+		info['layout'] = {}
+
+		# parse the layout
+		for line in lines:
+			member = MEMBER_REGEX.match(line)
+			if member == None:
+				continue
+
+			info['layout'][member.group(2)] = member.group(1)
 
-	data[struct] = info
+		data[struct] = info
 
-for struct in STRUCTS_COMMON + STRUCTS_PER_ARCH[ARCH]:
-	if not struct in data:
-		print('Failed to find ' + struct)
-		exit(1)
+	for struct in STRUCTS_COMMON + STRUCTS_PER_ARCH[arch]:
+		if not struct in data:
+			print('Failed to find ' + struct)
+			sys.exit(1)
 
-for struct in data:
-	if not struct in STRUCTS_COMMON + STRUCTS_PER_ARCH[ARCH]:
-		continue
+	header_lines = [
+		'#ifndef ' + HEADER_GUARD_NAME,
+		'#define ' + HEADER_GUARD_NAME,
+	]
+
+	for struct in data:
+		if not struct in STRUCTS_COMMON + STRUCTS_PER_ARCH[arch]:
+			continue
 
-	defs += '\n'
-	defs += '#define FLAYOUT_' + struct + '_SIZE ' + data[struct]['size'] + '\n'
-	defs += '#define FLAYOUT_' + struct + '_ALIGN ' + data[struct]['alignment'] + '\n'
+		header_lines.append('')
+		header_lines.append('#define FLAYOUT_' + struct + '_SIZE ' + data[struct]['size'])
+		header_lines.append('#define FLAYOUT_' + struct + '_ALIGN ' + data[struct]['alignment'])
 
-	for member in data[struct]['layout']:
-		defs += '#define FOFFSET_' + struct + '_' + member + ' ' + data[struct]['layout'][member] + '\n'
+		for member in data[struct]['layout']:
+			header_lines.append('#define FOFFSET_' + struct + '_' + member + ' ' + data[struct]['layout'][member])
 
-anillo_util.mkdir_p(os.path.dirname(OUTPUT_HEADER_PATH))
+	header_lines.append('')
+	header_lines.append('#endif // ' + HEADER_GUARD_NAME)
+	header_lines.append('')
 
-output_header_content = '#ifndef ' + HEADER_GUARD_NAME + '\n#define ' + HEADER_GUARD_NAME + '\n' + defs + '\n#endif // ' + HEADER_GUARD_NAME + '\n'
+	output_header_content = '\n'.join(header_lines)
 
-write_header = False
+	anillo_util.mkdir_p(os.path.dirname(output_header_path))
 
-if os.path.exists(OUTPUT_HEADER_PATH):
-	with io.open(OUTPUT_HEADER_PATH, 'r', newline='\n') as outfile:
-		file_content = outfile.read().strip()
-		if hashlib.sha256(output_header_content.strip().encode()).hexdigest() != hashlib.sha256(file_content.encode()).hexdigest():
-			write_header = True
-else:
-	write_header = True
+	anillo_util.write_if_changed(output_header_path, output_header_content)
+	anillo_util.write_if_changed(output_json_path, json.dumps(data, indent='\t'))
 
-if write_header:
-	with io.open(OUTPUT_HEADER_PATH, 'w', newline='\n') as outfile:
-		outfile.write(output_header_content)
+	# the depfile may have changed, so the key has to be computed after writing it for the next run to match it
+	anillo_util.save_inputs_digest(cache_key_path, cache_command, cache_inputs, output_depfile_path)
 
-with io.open(OUTPUT_JSON_PATH, 'w', newline='\n') as jsonfile:
-	json.dump(data, jsonfile, indent='\t')
+if __name__ == '__main__':
+	main()
@@ -9,20 +9,26 @@ SOURCE_ROOT = os.path.join(SCRIPT_DIR, '..', '..')
 sys.path.append(os.path.join(SOURCE_ROOT, 'scripts'))
 import anillo_util
 
-if len(sys.argv) != 4:
-	print('Usage: ' + sys.argv[0] + ' <input> <output> <array-name>')
-	sys.exit(1)
+def main():
+	if len(sys.argv) != 4:
+		print('Usage: ' + sys.argv[0] + ' <input> <output> <array-name>')
+		sys.exit(1)
 
-INPUT_PATH = sys.argv[1]
-OUTPUT_PATH = sys.argv[2]
-ARRAY_NAME = sys.argv[3]
+	input_path = sys.argv[1]
+	output_path = sys.argv[2]
+	array_name = sys.argv[3]
 
-contents = []
-with open(INPUT_PATH, 'rb') as file:
-	contents = bytearray(file.read())
+	with open(input_path, 'rb') as file:
+		contents = file.read()
 
-anillo_util.mkdir_p(os.path.dirname(OUTPUT_PATH))
+	# the array is defined by an assembly file next to the header, so that including the header doesn't define it again.
+	# the input is embedded straight from where it is, so its directory has to be an include directory for the assembly file.
+	assembly_path = os.path.splitext(output_path)[0] + '.S'
 
-with open(OUTPUT_PATH, 'wb') as outfile:
-	outfile.write(('#pragma once\n\n').encode())
-	outfile.write(anillo_util.to_c_array(ARRAY_NAME, contents).encode())
+	anillo_util.mkdir_p(os.path.dirname(output_path))
+
+	anillo_util.write_if_changed(assembly_path, anillo_util.to_incbin_assembly(array_name, os.path.basename(input_path), contents))
+	anillo_util.write_if_changed(output_path, '#pragma once\n\n#include <stdint.h>\n\n' + anillo_util.to_c_extern_array(array_name, contents))
+
+if __name__ == '__main__':
+	main()
@@ -2,7 +2,7 @@
 
 import os
 import struct
-import errno
+import array
 import sys
 
 SCRIPT_DIR = os.path.dirname(__file__)
@@ -11,152 +11,186 @@ SOURCE_ROOT = os.path.join(SCRIPT_DIR, '..', '..')
 sys.path.append(os.path.join(SOURCE_ROOT, 'scripts'))
 import anillo_util
 
-if len(sys.argv) != 3:
-	print('Usage: ' + sys.argv[0] + ' <input-font> <output-header>')
-	sys.exit(1)
-
-FONT_PATH = sys.argv[1]
-OUTPUT_PATH = sys.argv[2]
-
 HEADER_GUARD_NAME = '_GEN_FERRO_FONT_H'
 
-PSF1_MAGIC = bytearray([0x36, 0x04])
-PSF2_MAGIC = bytearray([0x72, 0xb5, 0x4a, 0x86])
+PSF1_MAGIC = bytes([0x36, 0x04])
+PSF2_MAGIC = bytes([0x72, 0xb5, 0x4a, 0x86])
 PSF2_UNICODE_FLAG = 0x01
 
 PSF1_512_FLAG = 0x01
 PSF1_UNICODE_FLAG = 0x02
 
-contents = []
-with open(FONT_PATH, 'rb') as file:
-	contents = bytearray(file.read())
+# magic, flags, glyph size
+PSF1_HEADER = struct.Struct('<2sBB')
+# magic, version, header size, flags, glyph count, glyph size, glyph height, glyph width
+PSF2_HEADER = struct.Struct('<4s7I')
 
-magic = bytearray(contents[0:2])
+PSF1_UNICODE_ENTRY = struct.Struct('<H')
 
-if magic != PSF1_MAGIC:
-	magic = bytearray(contents[0:4])
-	if magic != PSF2_MAGIC:
-		print('Invalid PSF magic')
-		exit(1)
-
-version = 0
-header_size = 0
-flags = 0
-glyph_count = 0
-glyph_size = 0
-glyph_height = 0
-glyph_width = 0
-
-if magic == PSF1_MAGIC:
-	header = struct.unpack('BB', contents[2:4])
-	header_size = 4
-	flags = header[0]
-	glyph_count = 512 if (flags & PSF1_512_FLAG) != 0 else 256
-	glyph_size = header[1]
-	glyph_width = 8
-	glyph_height = glyph_size
-elif magic == PSF2_MAGIC:
-	header = struct.unpack('IIIIIII', contents[4:32])
-	version = header[0]
-	header_size = header[1]
-	flags = header[2]
-	glyph_count = header[3]
-	glyph_size = header[4]
-	glyph_height = header[5]
-	glyph_width = header[6]
-
-table_offset = header_size + (glyph_size * glyph_count)
-unicode_map = [0] * 0xffff
-font_data = contents[0:table_offset]
-
-if magic == PSF1_MAGIC:
-	# Ferro expects a PSF2 font; let's convert the header to a PSF2 header
-	new_header = struct.pack('4BIIIIIII', PSF2_MAGIC[0], PSF2_MAGIC[1], PSF2_MAGIC[2], PSF2_MAGIC[3], version, struct.calcsize('4BIIIIIII'), PSF2_UNICODE_FLAG if (flags & PSF1_UNICODE_FLAG) != 0 else 0, glyph_count, glyph_size, glyph_height, glyph_width)
-	font_data = new_header + font_data[header_size:]
-
-if magic == PSF2_MAGIC and (flags & PSF2_UNICODE_FLAG) != 0:
-	table = contents[table_offset:]
+# the map is a flat array of uint16 glyph indices indexed by codepoint; it's embedded into the kernel as-is,
+# in little-endian byte order (the byte order of all the architectures we support).
+# it only extends as far as the highest codepoint the font maps; everything past that uses glyph 0.
+UNICODE_MAP_TYPECODE = 'H'
 
+# walks a PSF2 unicode table, storing the glyph index of each codepoint into the `unicode_map` dictionary.
+# raises a `ValueError` if the table contains malformed UTF-8.
+def parse_psf2_unicode_table(table, unicode_map):
 	# general process derived from https://wiki.osdev.org/PC_Screen_Font
+	entry_offset = 0
 
-	table_index = 0
-	glyph_index = 0
+	# each glyph's entry ends with a terminator, so splitting on it gives us the glyph index for free
+	# and leaves the decoder with nothing but codepoints to look at
+	for glyph_index, entry in enumerate(table.split(b'\xff')):
+		# skip combining symbols (everything after the first sequence marker)
+		codepoints = entry.split(b'\xfe', 1)[0]
 
-	def read_utf8():
-		curr = table[table_index]
+		# a malformed table is a broken font, so refuse to generate a map from it rather than guessing at what was meant
+		try:
+			codepoints = codepoints.decode('utf-8')
+		except UnicodeDecodeError as e:
+			raise ValueError('Invalid UTF-8 in unicode table at offset ' + str(entry_offset + e.start) + ' (glyph ' + str(glyph_index) + ')') from e
 
-		if curr & 0x80:
-			if (curr & 0x20) == 0:
-				curr = (((table[table_index] & 0x1f) << 6) | (table[table_index + 1] & 0x3f)) & 0xffff
-				table_index += 1
-			elif (curr & 0x10) == 0:
-				curr = (((table[table_index] & 0x0f) << 12) | ((table[table_index + 1] & 0x3f) << 6) | (table[table_index + 2] & 0x3f)) & 0xffff
-				table_index += 2
-			elif (curr & 0x08) == 0:
-				curr = (((table[table_index] & 0x07) << 18) | ((table[table_index + 1] & 0x3f) << 12) | ((table[table_index + 2] & 0x3f) << 6) | (table[table_index + 3] & 0x3f)) & 0xffff
-				table_index += 3
-			else:
-				curr = 0
+		for codepoint in codepoints:
+			unicode_map[ord(codepoint)] = glyph_index
 
-		table_index += 1
+		entry_offset += len(entry) + 1
 
-		return curr
-
-	while table_index < len(table):
-		curr = table[table_index]
-
-		if curr == 0xff:
-			# handle the terminator
-			table_index += 1
-			glyph_index += 1
-		elif curr == 0xfe:
-			# skip combining symbols
-			while curr != 0xff:
-				if curr == 0xfe:
-					table_index += 1
-					curr = table[table_index]
-				else:
-					read_utf8()
-					curr = table[table_index]
-
-			# now handle the terminator
-			table_index += 1
-			glyph_index += 1
-		else:
-			curr = read_utf8()
-			unicode_map[curr] = glyph_index
-elif magic == PSF1_MAGIC and (flags & PSF1_UNICODE_FLAG) != 0:
-	table = contents[table_offset:]
-
-	table_index = 0
+# walks a PSF1 unicode table, storing the glyph index of each codepoint into the `unicode_map` dictionary
+def parse_psf1_unicode_table(table, unicode_map):
 	glyph_index = 0
+	in_sequence = False
 
-	while table_index < len(table):
-		curr = struct.unpack_from('<H', table, table_index)[0]
-
-		if curr == 0xffff:
+	# entries are fixed-size, so we can let `struct` do all the iteration
+	for (entry,) in PSF1_UNICODE_ENTRY.iter_unpack(table[:len(table) - (len(table) % PSF1_UNICODE_ENTRY.size)]):
+		if entry == 0xffff:
 			# handle the terminator
-			table_index += 2
-			glyph_index += 1
-		elif curr == 0xfffe:
-			# skip combining symbols
-			while curr != 0xffff:
-				table_index += 2
-				curr = struct.unpack_from('<H', table, table_index)[0]
-
-			# now handle the terminator
-			table_index += 2
 			glyph_index += 1
-		else:
-			unicode_map[curr] = glyph_index
-			table_index += 2
-else:
-	unicode_map = []
-
-anillo_util.mkdir_p(os.path.dirname(OUTPUT_PATH))
-
-with open(OUTPUT_PATH, 'wb') as outfile:
-	outfile.write(('#ifndef ' + HEADER_GUARD_NAME + '\n#define ' + HEADER_GUARD_NAME + '\n\n#include <stdint.h>\n\n').encode())
-	outfile.write(anillo_util.to_c_array('font_data', font_data).encode())
-	outfile.write(anillo_util.to_c_array('unicode_map', unicode_map, 'uint16_t', lambda v: anillo_util.to_padded_hex(v, 4)).encode())
-	outfile.write(('\n#endif // ' + HEADER_GUARD_NAME + '\n').encode())
+			in_sequence = False
+		elif entry == 0xfffe:
+			# skip combining symbols (everything up to the terminator)
+			in_sequence = True
+		elif not in_sequence:
+			unicode_map[entry] = glyph_index
+
+def main():
+	if len(sys.argv) != 3:
+		print('Usage: ' + sys.argv[0] + ' <input-font> <output-header>')
+		sys.exit(1)
+
+	font_path = sys.argv[1]
+	output_path = sys.argv[2]
+	font_data_path = os.path.splitext(output_path)[0] + '-font_data.bin'
+	unicode_map_path = os.path.splitext(output_path)[0] + '-unicode_map.bin'
+	# the arrays are defined by an assembly file next to the header, so that including the header doesn't define them again
+	assembly_path = os.path.splitext(output_path)[0] + '.S'
+	cache_key_path = output_path + '.key'
+
+	# the outputs only depend on the font and on this script, so if neither has changed since the last run, there's nothing to do.
+	# the output path is left out so that moving the build directory doesn't invalidate the cache.
+	cache_command = [sys.executable, os.path.abspath(__file__), font_path]
+	cache_inputs = [font_path, os.path.abspath(__file__), anillo_util.__file__]
+
+	if anillo_util.outputs_up_to_date(cache_key_path, cache_command, cache_inputs, None, [output_path, assembly_path, font_data_path, unicode_map_path]):
+		return
+
+	with open(font_path, 'rb') as file:
+		contents = file.read()
+
+	if contents.startswith(PSF1_MAGIC):
+		magic = PSF1_MAGIC
+	elif contents.startswith(PSF2_MAGIC):
+		magic = PSF2_MAGIC
+	else:
+		print('Invalid PSF magic')
+		sys.exit(1)
+
+	version = 0
+	header_size = 0
+	flags = 0
+	glyph_count = 0
+	glyph_size = 0
+	glyph_height = 0
+	glyph_width = 0
+
+	if magic == PSF1_MAGIC:
+		_, flags, glyph_size = PSF1_HEADER.unpack_from(contents, 0)
+		header_size = PSF1_HEADER.size
+		glyph_count = 512 if (flags & PSF1_512_FLAG) != 0 else 256
+		glyph_width = 8
+		glyph_height = glyph_size
+	elif magic == PSF2_MAGIC:
+		_, version, header_size, flags, glyph_count, glyph_size, glyph_height, glyph_width = PSF2_HEADER.unpack_from(contents, 0)
+
+	table_offset = header_size + (glyph_size * glyph_count)
+	unicode_map = {}
+	# PSF2 glyph data is embedded unmodified, so there's no need to copy it out of the file contents
+	font_data = memoryview(contents)[0:table_offset]
+
+	if magic == PSF1_MAGIC:
+		# Ferro expects a PSF2 font; let's convert the header to a PSF2 header
+		new_header = PSF2_HEADER.pack(PSF2_MAGIC, version, PSF2_HEADER.size, PSF2_UNICODE_FLAG if (flags & PSF1_UNICODE_FLAG) != 0 else 0, glyph_count, glyph_size, glyph_height, glyph_width)
+		font_data = new_header + contents[header_size:table_offset]
+
+	has_unicode_map = (flags & (PSF1_UNICODE_FLAG if magic == PSF1_MAGIC else PSF2_UNICODE_FLAG)) != 0
+
+	if magic == PSF2_MAGIC and has_unicode_map:
+		table = contents[table_offset:]
+
+		parse_psf2_unicode_table(table, unicode_map)
+	elif magic == PSF1_MAGIC and has_unicode_map:
+		table = memoryview(contents)[table_offset:]
+
+		parse_psf1_unicode_table(table, unicode_map)
+
+	# a table that doesn't map any codepoints is no better than no table at all (and would produce a zero-length array)
+	if len(unicode_map) == 0:
+		has_unicode_map = False
+
+	# fonts usually only cover a small part of the BMP (if that), so only allocate as much of the map as we need
+	unicode_map_length = max(unicode_map) + 1 if has_unicode_map else 0
+	unicode_map_data = array.array(UNICODE_MAP_TYPECODE, [0]) * unicode_map_length
+
+	for codepoint, glyph_index in unicode_map.items():
+		unicode_map_data[codepoint] = glyph_index
+
+	if sys.byteorder != 'little':
+		unicode_map_data.byteswap()
+
+	unicode_map_bytes = unicode_map_data.tobytes()
+
+	anillo_util.mkdir_p(os.path.dirname(output_path))
+
+	# like the header, these are only rewritten when they change, since the assembly embedding them gets rebuilt whenever they do
+	anillo_util.write_if_changed(font_data_path, font_data)
+	# this is written even for fonts without a unicode table (in which case it's empty), since the build expects it to exist
+	anillo_util.write_if_changed(unicode_map_path, unicode_map_bytes)
+
+	header_parts = [
+		'#ifndef ' + HEADER_GUARD_NAME + '\n#define ' + HEADER_GUARD_NAME + '\n\n#include <stdint.h>\n\n',
+		anillo_util.to_c_extern_array('font_data', font_data),
+	]
+	assembly_parts = [
+		anillo_util.to_incbin_assembly('font_data', os.path.basename(font_data_path), font_data),
+	]
+
+	# without a unicode table, leave the map out entirely so that consumers can compile out their lookups
+	if has_unicode_map:
+		header_parts += [
+			'#define FONT_HAS_UNICODE_MAP 1\n',
+			'#define UNICODE_MAP_LENGTH ' + str(unicode_map_length) + '\n',
+			anillo_util.to_c_extern_array('unicode_map', unicode_map_bytes, 'uint16_t', unicode_map_data.itemsize),
+		]
+		assembly_parts.append(anillo_util.to_incbin_assembly('unicode_map', os.path.basename(unicode_map_path), unicode_map_bytes))
+	else:
+		header_parts.append('#define FONT_HAS_UNICODE_MAP 0\n')
+
+	header_parts.append('\n#endif // ' + HEADER_GUARD_NAME + '\n')
+
+	header_content = ''.join(header_parts)
+
+	anillo_util.write_if_changed(assembly_path, '\n'.join(assembly_parts))
+	anillo_util.write_if_changed(output_path, header_content)
+	anillo_util.save_inputs_digest(cache_key_path, cache_command, cache_inputs)
+
+if __name__ == '__main__':
+	main()
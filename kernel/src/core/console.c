@@ -48,7 +48,7 @@ FERRO_PACKED_STRUCT(ferro_console_font) {
 	uint8_t glyphs[];
 };
 
-ferro_console_font_t* font = (ferro_console_font_t*)font_data;
+const ferro_console_font_t* font = (const ferro_console_font_t*)font_data;
 
 // protects a string from being written
 // (this is so that we don't get jumbled character writes)
@@ -134,8 +134,12 @@ static uint8_t utf32_to_utf8(uint32_t code_point, char* out_bytes) {
 };
 
 static ferr_t fconsole_put_utf32_char(uint32_t unichar, size_t x, size_t y, const ferro_fb_pixel_t* foreground, const ferro_fb_pixel_t* background) {
-	uint16_t index = (font->flags & PSF_FLAG_UNICODE) ? unicode_map[unichar] : (uint16_t)(unichar & 0xffff);
-	uint8_t* glyph;
+#if FONT_HAS_UNICODE_MAP
+	uint16_t index = (unichar < UNICODE_MAP_LENGTH) ? unicode_map[unichar] : 0;
+#else
+	uint16_t index = (uint16_t)(unichar & 0xffff);
+#endif
+	const uint8_t* glyph;
 
 	if (index > font->glyph_count) {
 		index = 0;
@@ -144,7 +148,7 @@ static ferr_t fconsole_put_utf32_char(uint32_t unichar, size_t x, size_t y, cons
 	glyph = &font->glyphs[index * font->glyph_size];
 
 	for (uint32_t glyph_y = 0; glyph_y < font->glyph_height; ++glyph_y) {
-		uint8_t* row = &glyph[glyph_y * ((font->glyph_width + 7) / 8)];
+		const uint8_t* row = &glyph[glyph_y * ((font->glyph_width + 7) / 8)];
 
 		for (uint32_t glyph_x = 0; glyph_x < font->glyph_width; ++glyph_x) {
 			(void)ferro_fb_set_pixel((row[glyph_x / 8] & (1 << (7 - (glyph_x % 8)))) ? foreground : background, x + glyph_x, y + glyph_y);
@@ -10,9 +10,17 @@ from typing import Dict, List, Set, Tuple, cast
 from enum import IntEnum
 import argparse
 import os
+from pathlib import Path
 from ast import literal_eval
 import json
-import copy
+import io
+import lark
+
+SCRIPT_DIR = os.path.dirname(__file__)
+SOURCE_ROOT = os.path.join(SCRIPT_DIR, '..', '..')
+
+sys.path.append(os.path.join(SOURCE_ROOT, 'scripts'))
+import anillo_util
 
 this_module = sys.modules[__name__]
 
@@ -25,10 +33,14 @@ class Realm(IntEnum):
 	LOCAL    = 2
 	CHILDREN = 3
 
-names: Set[str] = set()
 next_type_id: int = 0
 type_to_id: Dict[Type, int] = dict()
 id_to_type: Dict[int, Type] = dict()
+basic_types: Dict[int, 'BasicType'] = dict()
+structure_types: Dict[int, 'StructureType'] = dict()
+function_types: Dict[int, 'FunctionType'] = dict()
+# the C type used for each basic or structure type ID in generated source (e.g. for structure members)
+native_types_for_source: Dict[int, str] = dict()
 interface_names: Set[str] = set()
 struct_types: Dict[str, Type] = dict()
 max_type_members: int = 0
@@ -40,10 +52,10 @@ default_realm: Realm | None = None
 def name_to_type(name: str) -> Type:
 	type: Type | None = None
 
-	if name in BasicTypeTag.__members__:
-		type = BasicType(BasicTypeTag[name])
+	if name in BASIC_TYPES_BY_NAME:
+		type = BASIC_TYPES_BY_NAME[name]
 	elif name in interface_names:
-		type = BasicType(BasicTypeTag.proxy)
+		type = BASIC_TYPES[BasicTypeTag.proxy]
 	elif name in struct_types:
 		type = struct_types[name]
 	else:
@@ -66,11 +78,18 @@ def ensure_type_to_id(type: Type) -> int:
 	type_to_id[type] = type_id
 	id_to_type[type_id] = type
 
+	if isinstance(type, BasicType):
+		basic_types[type_id] = type
+		native_types_for_source[type_id] = BASIC_TYPE_TAG_TO_NATIVE_TYPE[type.tag]
+
 	if isinstance(type, StructureType):
 		max_type_members = max(max_type_members, len(type.members))
+		structure_types[type_id] = type
+		native_types_for_source[type_id] = f'struct _spookygen_struct_{type_id}'
 
 	if isinstance(type, FunctionType):
 		max_type_params = max(max_type_params, len(type.parameters))
+		function_types[type_id] = type
 
 	return type_id
 
@@ -115,21 +134,35 @@ BASIC_TYPE_TAG_TO_NATIVE_TYPE = {
 	BasicTypeTag.channel : 'sys_channel_t*',
 }
 
-def type_is_refcounted(type: BasicTypeTag) -> bool:
-	return type == BasicTypeTag.data or type == BasicTypeTag.proxy or type == BasicTypeTag.channel
+REFCOUNTED_BASIC_TYPE_TAGS = frozenset([BasicTypeTag.data, BasicTypeTag.proxy, BasicTypeTag.channel])
+CONSUMED_BASIC_TYPE_TAGS = frozenset([BasicTypeTag.channel])
+LIBSYS_BASIC_TYPE_TAGS = frozenset([BasicTypeTag.channel])
 
-def type_is_consumed(type: BasicTypeTag) -> bool:
-	return type == BasicTypeTag.channel
+# the prefix of the release function (`sys_release` or `spooky_release`) for each refcounted type
+RELEASE_PREFIXES: Dict[BasicTypeTag, str] = { tag: 'sys' if tag in LIBSYS_BASIC_TYPE_TAGS else 'spooky' for tag in REFCOUNTED_BASIC_TYPE_TAGS }
 
-def type_is_libsys(type: BasicTypeTag) -> bool:
-	return type == BasicTypeTag.channel
+# the extra `retain` argument passed to `spooky_invocation_get_*` for each type (only refcounted types take one).
+# incoming wrappers borrow the invocation's reference, while outgoing wrappers hand a new reference to the caller.
+INCOMING_RETAIN_ARGS: Dict[BasicTypeTag, str] = { tag: ', false' if tag in REFCOUNTED_BASIC_TYPE_TAGS else '' for tag in BasicTypeTag }
+OUTGOING_RETAIN_ARGS: Dict[BasicTypeTag, str] = { tag: ', true' if tag in REFCOUNTED_BASIC_TYPE_TAGS else '' for tag in BasicTypeTag }
 
-def type_to_native_for_source(type: Type) -> str:
-	if isinstance(type, BasicType):
-		return BASIC_TYPE_TAG_TO_NATIVE_TYPE[type.tag]
-	elif isinstance(type, StructureType):
-		return f'struct _spookygen_struct_{type_to_id[type]}'
-	raise TypeError
+PARAMETER_DIRECTION_NAMES = {
+	Direction.IN: 'spooky_function_parameter_direction_in',
+	Direction.OUT: 'spooky_function_parameter_direction_out',
+}
+
+# decorations are stored as a bitmask of these flags
+DECORATION_NOWAIT = 1 << 0
+
+DECORATION_FLAGS: Dict[str, int] = {
+	'nowait': DECORATION_NOWAIT,
+}
+
+def type_is_refcounted(type: BasicTypeTag) -> bool:
+	return type in REFCOUNTED_BASIC_TYPE_TAGS
+
+def type_is_consumed(type: BasicTypeTag) -> bool:
+	return type in CONSUMED_BASIC_TYPE_TAGS
 
 class _AST(ast_utils.Ast):
 	pass
@@ -138,11 +171,13 @@ class _Entry(_AST):
 	pass
 
 class Decorations(_AST, ast_utils.AsList):
-	decorations: Set[str]
+	decorations: int
 
 	def __init__(self, decorations: List[str]) -> None:
 		super().__init__()
-		self.decorations = set(decorations)
+		self.decorations = 0
+		for decoration in decorations:
+			self.decorations |= DECORATION_FLAGS[decoration]
 
 class Parameter(_AST):
 	name: str
@@ -156,6 +191,7 @@ class Parameter(_AST):
 		self.direction = direction
 		self.type_id = type_tuple[0]
 		self.type = type_tuple[1]
+		self._hash = hash((self.direction, self.type_id))
 
 	def __eq__(self, other: object) -> bool:
 		if not isinstance(other, Parameter):
@@ -163,7 +199,7 @@ class Parameter(_AST):
 		return self.direction == other.direction and self.type_id == other.type_id
 
 	def __hash__(self) -> int:
-		return hash((self.direction, self.type_id))
+		return self._hash
 
 	def __repr__(self) -> str:
 		return f'Parameter(name={repr(self.name)}, direction={repr(self.direction)}, type_id={repr(self.type_id)})'
@@ -180,27 +216,43 @@ class BasicType(Type):
 	def __hash__(self) -> int:
 		return hash(self.tag)
 
+# basic types carry no state other than their tag, so every reference to one can share the same instance
+BASIC_TYPES: Dict[BasicTypeTag, BasicType] = { tag: BasicType(tag) for tag in BasicTypeTag }
+
+# these are keyed by the names used in definition files; plain dictionaries are much cheaper to query than the enum's `__members__` mapping
+BASIC_TYPES_BY_NAME: Dict[str, BasicType] = { name: BASIC_TYPES[tag] for name, tag in BasicTypeTag.__members__.items() }
+NATIVE_TYPES_BY_NAME: Dict[str, str] = { name: BASIC_TYPE_TAG_TO_NATIVE_TYPE[tag] for name, tag in BasicTypeTag.__members__.items() }
+
 @dataclass
 class StructureType(Type):
 	name: str
 	members: List[int]
 
+	def __post_init__(self) -> None:
+		# types are hashed every time they're looked up in `type_to_id`, and they never change once created
+		self._hash = hash(tuple(self.members))
+
 	def __eq__(self, other: object) -> bool:
 		if not isinstance(other, StructureType):
 			return False
 		return self.members == other.members
 
 	def __hash__(self) -> int:
-		return hash(tuple(self.members))
+		return self._hash
 
 class FunctionType(Type):
-	decorations: Set[str]
+	decorations: int
 	parameters: List[Parameter]
 
 	def __init__(self, decorations: Decorations, *params: Parameter) -> None:
 		super().__init__()
-		self.decorations = decorations.decorations if decorations != None else set()
+		self.decorations = decorations.decorations if decorations != None else 0
 		self.parameters = list(params)
+		# parameter names don't affect the type, so two function types are the same if their decorations and
+		# their parameters' directions and types match. this reduces that to plain values that are cheap to compare and hash.
+		self._signature = (self.decorations, tuple((param.direction, param.type_id) for param in self.parameters))
+		# like with `StructureType`, the hash is computed once up-front
+		self._hash = hash(self._signature)
 
 	def __repr__(self) -> str:
 		return f"FunctionType(decorations={repr(self.decorations)}, parameters={repr(self.parameters)})"
@@ -208,27 +260,21 @@ class FunctionType(Type):
 	def __eq__(self, other: object) -> bool:
 		if not isinstance(other, FunctionType):
 			return False
-		return self.decorations == other.decorations and self.parameters == other.parameters
+		return self._signature == other._signature
 
 	def __hash__(self) -> int:
-		return hash((tuple(self.decorations), tuple(self.parameters)))
+		return self._hash
 
 class Function(_Entry):
 	name: str
-	decorations: Set[str]
+	decorations: int
 	parameters: List[Parameter]
 	type_id: int
 
 	def __init__(self, decorations: Decorations, name: str, *params: Parameter) -> None:
 		super().__init__()
 
-		if name in names:
-			print(f"Conflicating name: {name}", file=sys.stderr)
-			exit(1)
-
-		names.add(name)
-
-		self.decorations = decorations.decorations if decorations != None else set()
+		self.decorations = decorations.decorations if decorations != None else 0
 		self.name = name
 		self.parameters = list(params)
 		self.type_id = ensure_type_to_id(FunctionType(decorations, *params))
@@ -260,12 +306,6 @@ class Structure(_Entry):
 	def __init__(self, name: str, *members: Member) -> None:
 		super().__init__()
 
-		if name in names:
-			print(f"Conflicating name: {name}", file=sys.stderr)
-			exit(1)
-
-		names.add(name)
-
 		self.name = name
 		self.members = list(members)
 
@@ -352,40 +392,74 @@ argparser.add_argument('--server', action='store_true', help='Generate server-si
 argparser.add_argument('-i', '--input', required=True, help='The RPC definition file to parse')
 argparser.add_argument('-s', '--source', required=True, help='A path for the resulting wrapper source file')
 argparser.add_argument('-H', '--header', required=True, help='A path for the resulting wrapper header file')
+argparser.add_argument('-c', '--cache-dir', help='A directory owned by the build in which to cache the analyzed grammar between runs. If omitted, nothing is cached.')
 args = argparser.parse_args()
 
-lark_parser = Lark.open('spooky.lark', rel_to=__file__, maybe_placeholders=True, parser="lalr")
+# given a path, Lark stores the analyzed grammar (including the LALR tables) there, along with a hash of the grammar,
+# the options, and the Lark version, so only the first run has to build it.
+# the cache is loaded with pickle, so it's only ever kept in a directory the build owns (never in the shared temporary directory).
+# the file is named after the Lark and Python versions so that builds using different installs never fight over the same file.
+lark_cache_path: str | bool = False
+if args.cache_dir != None:
+	os.makedirs(args.cache_dir, exist_ok=True)
+	lark_cache_path = os.path.join(args.cache_dir, f'spooky.lark-{lark.__version__}-py{sys.version_info[0]}.{sys.version_info[1]}.cache')
+
+lark_parser = Lark.open('spooky.lark', rel_to=__file__, maybe_placeholders=True, parser="lalr", cache=lark_cache_path)
 lark_trans = ast_utils.create_transformer(this_module, ToAST())
 
-input_file = open(args.input)
-parse_tree = lark_parser.parse(input_file.read())
-input_file.close()
+with open(args.input) as input_file:
+	parse_tree = lark_parser.parse(input_file.read())
 
 ast: List[Interface | Structure] = lark_trans.transform(parse_tree)
 
 if default_realm == None:
 	default_realm = Realm.GLOBAL
 
-structures: List[Structure] = [x for x in ast if isinstance(x, Structure)]
-interfaces: List[Interface] = [x for x in ast if isinstance(x, Interface)]
+structures: List[Structure] = []
+interfaces: List[Interface] = []
 
-if os.path.dirname(args.source) != '':
-	os.makedirs(os.path.dirname(args.source), exist_ok=True)
+# structures and functions (from all interfaces) share a single namespace
+names: Set[str] = set()
 
-if os.path.dirname(args.header) != '':
-	os.makedirs(os.path.dirname(args.header), exist_ok=True)
+def ensure_unique_name(name: str) -> None:
+	if name in names:
+		print(f"Conflicating name: {name}", file=sys.stderr)
+		sys.exit(1)
 
-source_file = open(args.source, 'w')
-header_file = open(args.header, 'w')
+	names.add(name)
+
+for entry in ast:
+	if isinstance(entry, Structure):
+		ensure_unique_name(entry.name)
+		structures.append(entry)
+	elif isinstance(entry, Interface):
+		for function in entry.functions:
+			ensure_unique_name(function.name)
+		interfaces.append(entry)
+
+structures_by_name: Dict[str, Structure] = { x.name: x for x in structures }
+interfaces_by_name: Dict[str, Interface] = { x.name: x for x in interfaces }
+
+# for bare filenames the parent is `.`, which always exists
+Path(args.source).parent.mkdir(parents=True, exist_ok=True)
+Path(args.header).parent.mkdir(parents=True, exist_ok=True)
+
+# everything is generated into memory first and then written out in one go at the end;
+# the wrappers are emitted in lots of small pieces, and this way none of them has to go through the file layer
+source_file = io.StringIO()
+header_file = io.StringIO()
+
+# every public function is declared with this (overridable) storage class macro
+storage_macro = f'SPOOKYGEN_{root_interface_name}_STORAGE'
 
 header_file.writelines([
 	f'#pragma once\n',
 	'\n',
 	f'#include <libspooky/libspooky.h>\n',
 	'\n',
-	f'#ifndef SPOOKYGEN_{root_interface_name}_STORAGE\n',
-	f'\t#define SPOOKYGEN_{root_interface_name}_STORAGE\n',
-	f'#endif // SPOOKYGEN_{root_interface_name}_STORAGE\n',
+	f'#ifndef {storage_macro}\n',
+	f'\t#define {storage_macro}\n',
+	f'#endif // {storage_macro}\n',
 	'\n',
 ])
 
@@ -397,16 +471,18 @@ def write_struct(struct: Structure):
 
 	written_structs.add(struct.name)
 
-	header_file.write(f'struct {struct.name} {{\n')
+	lines: List[str] = [f'struct {struct.name} {{\n']
 	for member in struct.members:
 		type_str = ''
-		if member.type_name in BasicTypeTag.__members__:
-			type_str = BASIC_TYPE_TAG_TO_NATIVE_TYPE[BasicTypeTag[member.type_name]]
+		if member.type_name in NATIVE_TYPES_BY_NAME:
+			type_str = NATIVE_TYPES_BY_NAME[member.type_name]
 		else:
-			write_struct(next(x for x in structures if x.name == member.type_name))
+			write_struct(structures_by_name[member.type_name])
 			type_str = f'struct {member.type_name}'
-		header_file.write(f'\t{type_str} {member.name};\n')
-	header_file.write('};\n\n')
+		lines.append(f'\t{type_str} {member.name};\n')
+	lines.append('};\n\n')
+
+	header_file.write(''.join(lines))
 
 for structure in structures:
 	write_struct(structure)
@@ -443,44 +519,40 @@ else:
 		'\n',
 	])
 
-for type_id in range(0, next_type_id):
-	type = id_to_type[type_id]
+# the structure definitions and the code that creates their spooky types are built in the same pass
+struct_definitions: List[str] = []
+struct_init_lines: List[str] = []
 
-	if not isinstance(type, StructureType):
-		continue
+for type_id, type in structure_types.items():
+	struct_definitions.append(f'struct _spookygen_struct_{type_id} {{\n')
+	struct_definitions.extend([f'\t{native_types_for_source[member]} _spookygen_member_{index};\n' for index, member in enumerate(type.members)])
+	struct_definitions.append('};\n\n')
 
-	source_file.write(f'struct _spookygen_struct_{type_id} {{\n')
-	for index, member in enumerate(type.members):
-		member_type = id_to_type[member]
-		source_file.write(f'\t{type_to_native_for_source(member_type)} _spookygen_member_{index};\n')
-	source_file.write('};\n\n')
+	struct_init_lines.extend([f'\tmembers[{index}].type = _spookygen_types[{member}];\n\tmembers[{index}].offset = offsetof(struct _spookygen_struct_{type_id}, _spookygen_member_{index});\n' for index, member in enumerate(type.members)])
+	struct_init_lines.append(f'\tsys_abort_status_log(spooky_structure_create(sizeof(struct _spookygen_struct_{type_id}), members, {len(type.members)}, &_spookygen_types[{type_id}]));\n')
 
-source_file.writelines([
+source_file.write(''.join(struct_definitions))
+
+init_lines: List[str] = [
 	'static void _spookygen_init(void* context) {\n',
 	f'\tspooky_structure_member_t members[{max_type_members}];\n',
 	f'\tspooky_function_parameter_t parameters[{max_type_params}];\n',
 	'\n',
-])
+]
 
-for type_id in range(0, next_type_id):
-	type = id_to_type[type_id]
+# every type only depends on types with lower IDs, and structures can't contain functions,
+# so initializing all basic types, then all structures, then all functions keeps dependencies initialized first
+init_lines.extend([f'\t_spookygen_types[{type_id}] = spooky_type_{type.tag.name}();\n' for type_id, type in basic_types.items()])
 
-	if isinstance(type, BasicType):
-		source_file.write(f'\t_spookygen_types[{type_id}] = spooky_type_{type.tag.name}();\n')
-	elif isinstance(type, StructureType):
-		for index, member in enumerate(type.members):
-			source_file.write(f'\tmembers[{index}].type = _spookygen_types[{member}];\n')
-			source_file.write(f'\tmembers[{index}].offset = offsetof(struct _spookygen_struct_{type_id}, _spookygen_member_{index});\n')
+init_lines.extend(struct_init_lines)
 
-		source_file.write(f'\tsys_abort_status_log(spooky_structure_create(sizeof(struct _spookygen_struct_{type_id}), members, {len(type.members)}, &_spookygen_types[{type_id}]));\n')
-	elif isinstance(type, FunctionType):
-		does_wait = not ('nowait' in type.decorations)
+for type_id, type in function_types.items():
+	does_wait = not (type.decorations & DECORATION_NOWAIT)
 
-		for index, param in enumerate(type.parameters):
-			source_file.write(f'\tparameters[{index}].type = _spookygen_types[{param.type_id}];\n')
-			source_file.write(f'\tparameters[{index}].direction = {"spooky_function_parameter_direction_in" if param.direction == Direction.IN else "spooky_function_parameter_direction_out"};\n')
+	init_lines.extend([f'\tparameters[{index}].type = _spookygen_types[{param.type_id}];\n\tparameters[{index}].direction = {PARAMETER_DIRECTION_NAMES[param.direction]};\n' for index, param in enumerate(type.parameters)])
+	init_lines.append(f'\tsys_abort_status_log(spooky_function_create({"true" if does_wait else "false"}, parameters, {len(type.parameters)}, &_spookygen_types[{type_id}]));\n')
 
-		source_file.write(f'\tsys_abort_status_log(spooky_function_create({"true" if does_wait else "false"}, parameters, {len(type.parameters)}, &_spookygen_types[{type_id}]));\n')
+source_file.write(''.join(init_lines))
 
 source_file.writelines([
 	'};\n',
@@ -491,25 +563,53 @@ source_file.writelines([
 	'\n',
 ])
 
+# outgoing wrappers release refcounted output arguments they've already filled in when a later step fails;
+# rather than repeating that check for every such argument, each wrapper calls a shared helper for the right release function
+release_on_fail_prefixes: Set[str] = set()
+
+for type in function_types.values():
+	for param in type.parameters:
+		if param.direction == Direction.OUT and isinstance(param.type, BasicType) and type_is_refcounted(param.type.tag):
+			release_on_fail_prefixes.add(RELEASE_PREFIXES[param.type.tag])
+
+for prefix in sorted(release_on_fail_prefixes):
+	source_file.writelines([
+		f'static inline void _spookygen_{prefix}_release_on_fail({prefix}_object_t** object, bool should_cleanup) {{\n',
+		'\tif (object && should_cleanup) {\n',
+		f'\t\t{prefix}_release(*object);\n',
+		'\t}\n',
+		'};\n',
+		'\n',
+	])
+
+def format_basic_parameter(prefix: str, param: Parameter, use_generic_type: bool) -> str:
+	ptr = '*' if param.direction == Direction.OUT else ''
+	return f'{BASIC_TYPE_TAG_TO_NATIVE_TYPE[param.type.tag]}{ptr} {param.name}'
+
+def format_structure_parameter(prefix: str, param: Parameter, use_generic_type: bool) -> str:
+	const = 'const ' if param.direction == Direction.IN else ''
+	struct_name = f'_spookygen_struct_{param.type_id}' if use_generic_type else param.type.name
+	return f'{const}struct {struct_name}* {param.name}'
+
+def format_function_parameter(prefix: str, param: Parameter, use_generic_type: bool) -> str:
+	extra_ptr = '*' if param.direction == Direction.OUT else ''
+	func_type_name = f'_spookygen_type_{param.type_id}_f' if use_generic_type else f'{prefix}_{param.name}_f'
+	return f'{func_type_name}{extra_ptr} {param.name}, void*{extra_ptr} _context_{param.name}'
+
+PARAMETER_FORMATTERS = {
+	BasicType: format_basic_parameter,
+	StructureType: format_structure_parameter,
+	FunctionType: format_function_parameter,
+}
+
 def write_parameters(file, prefix: str, params: List[Parameter], is_first: bool, use_generic_type: bool = False):
-	for index, param in enumerate(params):
-		if not is_first or index != 0:
-			file.write(', ')
+	if len(params) == 0:
+		return
 
-		if isinstance(param.type, BasicType):
-			file.write(BASIC_TYPE_TAG_TO_NATIVE_TYPE[param.type.tag])
-			if param.direction == Direction.OUT:
-				file.write('*')
-			file.write(f' {param.name}')
-		elif isinstance(param.type, StructureType):
-			if param.direction == Direction.IN:
-				file.write('const ')
-			struct_name = f'_spookygen_struct_{param.type_id}' if use_generic_type else param.type.name
-			file.write(f'struct {struct_name}* {param.name}')
-		elif isinstance(param.type, FunctionType):
-			extra_ptr = '*' if param.direction == Direction.OUT else ''
-			func_type_name = f'_spookygen_type_{param.type_id}_f' if use_generic_type else f'{prefix}_{param.name}_f'
-			file.write(f'{func_type_name}{extra_ptr} {param.name}, void*{extra_ptr} _context_{param.name}')
+	if not is_first:
+		file.write(', ')
+
+	file.write(', '.join([PARAMETER_FORMATTERS[param.type.__class__](prefix, param, use_generic_type) for param in params]))
 
 def write_param_type(prefix: str, param: Parameter):
 	if not isinstance(param.type, FunctionType):
@@ -522,22 +622,42 @@ def write_param_type(prefix: str, param: Parameter):
 	write_parameters(header_file, f'{prefix}_{param.name}', param.type.parameters, False)
 	header_file.write(');\n')
 
+# returns copies of the given parameters, renamed to `arg0`, `arg1`, etc.;
+# the types are shared with the originals, since they're never modified after parsing
+def generic_parameters(params: List[Parameter]) -> List[Parameter]:
+	return [Parameter(f'arg{index}', param.direction, (param.type_id, param.type)) for index, param in enumerate(params)]
+
+generic_signatures: Dict[int, str] = dict()
+
+# returns the generic parameter list for the given function type, formatted to follow a leading `void* _context` parameter;
+# this is the same for every wrapper and typedef of the type, so it's only formatted once
+def generic_signature(type: FunctionType) -> str:
+	type_id = type_to_id[type]
+
+	if type_id not in generic_signatures:
+		generic_signatures[type_id] = ''.join([', ' + PARAMETER_FORMATTERS[param.type.__class__]('', param, True) for param in generic_parameters(type.parameters)])
+
+	return generic_signatures[type_id]
+
+written_function_types: Set[int] = set()
+
 def write_function_type(type: Type):
 	if not isinstance(type, FunctionType):
 		return
 
-	params = copy.deepcopy(type.parameters)
+	type_id = type_to_id[type]
 
-	for index, param in enumerate(params):
-		param.name = f'arg{index}'
+	if type_id in written_function_types:
+		return
+
+	written_function_types.add(type_id)
+
+	for param in type.parameters:
 		write_function_type(param.type)
 
-	source_file.write(f'typedef ferr_t (*_spookygen_type_{type_to_id[type]}_f)(void* _context')
-	write_parameters(source_file, '', params, False, True)
-	source_file.write(');\n')
+	source_file.write(f'typedef ferr_t (*_spookygen_type_{type_id}_f)(void* _context{generic_signature(type)});\n')
 
-for type_id in range(0, next_type_id):
-	type = id_to_type[type_id]
+for type in function_types.values():
 	write_function_type(type)
 
 for interface in interfaces:
@@ -556,7 +676,7 @@ for interface in interfaces:
 			header_file.write(');\n\n')
 
 		if not args.server or not is_root_interface:
-			header_file.write(f'SPOOKYGEN_{root_interface_name}_STORAGE LIBSPOOKY_WUR ferr_t {interface.name}_{function.name}(void* context')
+			header_file.write(f'{storage_macro} LIBSPOOKY_WUR ferr_t {interface.name}_{function.name}(void* context')
 			write_parameters(header_file, f'{interface.name}_{function.name}', function.parameters, False)
 			header_file.write(');\n\n')
 
@@ -573,24 +693,147 @@ for interface in interfaces:
 
 	header_file.write(f'}} {interface.name}_proxy_info_t;\n\n')
 
+string_literals: Dict[str, str] = dict()
+
+# returns the given string quoted as a C string literal;
+# function names are quoted for the client wrappers as well as the server and proxy entry tables, so each is only encoded once
+def c_string_literal(string: str) -> str:
+	if string not in string_literals:
+		string_literals[string] = json.dumps(string)
+
+	return string_literals[string]
+
 written_names: Set[str] = set()
 
-# i.e. for interface implementations or input callback implementations
-# invoked remotely by libspooky
-def write_incoming_function_wrapper(name: str, type: FunctionType, target_name: str | None, is_root_interface: bool, raw_name: str | None):
-	if name in written_names:
-		return
+# emitted after every call whose status needs to be checked
+CHECK_STATUS = '\tif (status != ferr_ok) {\n\t\tgoto out;\n\t}\n'
+
+# writes the given wrapper after first writing the wrappers for any callbacks it takes (and their callbacks, and so on).
+# this walks the callbacks with an explicit stack rather than recursing, so deeply nested callback types can't overflow the Python stack.
+#
+# incoming wrappers need outgoing wrappers for their input callbacks and incoming wrappers for their output callbacks;
+# outgoing wrappers are the other way around.
+def write_function_wrapper(is_incoming: bool, name: str, type: FunctionType, target_name: str | None, is_root_interface: bool, raw_name: str | None):
+	# each entry is (dependencies_written, is_incoming, name, type, target_name, is_root_interface, raw_name)
+	stack: List[Tuple[bool, bool, str, FunctionType, str | None, bool, str | None]] = [(False, is_incoming, name, type, target_name, is_root_interface, raw_name)]
+
+	while len(stack) > 0:
+		dependencies_written, is_incoming, name, type, target_name, is_root_interface, raw_name = stack.pop()
+
+		if dependencies_written:
+			if is_incoming:
+				write_incoming_function_wrapper(name, type, target_name, is_root_interface, raw_name)
+			else:
+				write_outgoing_function_wrapper(name, type, target_name, is_root_interface, raw_name)
+			continue
+
+		if name in written_names:
+			continue
+
+		written_names.add(name)
+
+		stack.append((True, is_incoming, name, type, target_name, is_root_interface, raw_name))
+
+		# pushed in reverse so that the callbacks are written in parameter order
+		for param in reversed(type.parameters):
+			if isinstance(param.type, FunctionType):
+				callback_is_incoming = (param.direction == Direction.OUT) == is_incoming
+				callback_name = f'_spookygen_callback_handler_{param.type_id}' if callback_is_incoming else f'_spookygen_callback_{param.type_id}'
+				stack.append((False, callback_is_incoming, callback_name, param.type, None, False, None))
+
+incoming_cleanup_codes: Dict[int, str] = dict()
+
+# returns the code that releases an incoming wrapper's arguments once the invocation is done with them;
+# this only depends on the function type, so it's only generated once per type
+def incoming_cleanup_code(type: FunctionType) -> str:
+	type_id = type_to_id[type]
+
+	if type_id in incoming_cleanup_codes:
+		return incoming_cleanup_codes[type_id]
 
-	written_names.add(name)
+	lines: List[str] = []
 
 	for index, param in enumerate(type.parameters):
-		if isinstance(param.type, FunctionType):
-			if param.direction == Direction.IN:
-				write_outgoing_function_wrapper(f'_spookygen_callback_{param.type_id}', param.type, None, False, None)
-			else:
-				write_incoming_function_wrapper(f'_spookygen_callback_handler_{param.type_id}', param.type, None, False, None)
+		if param.direction == Direction.IN:
+			#if isinstance(param.type, FunctionType):
+			#	lines.extend([
+			#		'\n',
+			#		f'\tif (arg{index}_invocation) {{\n',
+			#		f'\t\tspooky_release(arg{index}_invocation);\n',
+			#		'\t}\n',
+			#		'\n',
+			#	])
+			pass
+		else:
+			if isinstance(param.type, BasicType):
+				if type_is_refcounted(param.type.tag):
+					lines.extend([
+						f'\tif (arg{index}) {{\n',
+						f'\t\t{RELEASE_PREFIXES[param.type.tag]}_release(arg{index});\n',
+						'\t}\n',
+					])
+			elif isinstance(param.type, StructureType):
+				lines.append(f'\tspooky_release_object_with_type(&arg{index}, _spookygen_types[{param.type_id}]);\n')
+			elif isinstance(param.type, FunctionType):
+				lines.extend([
+					'\n',
+					f'\tif (arg{index}_callback_context) {{\n',
+					'\t\t// TODO: cleanup target context somehow\n',
+					f'\t\tLIBSPOOKY_WUR_IGNORE(sys_mempool_free(arg{index}_callback_context));\n',
+					'\t}\n',
+					'\n',
+				])
 
-	source_file.writelines([
+	incoming_cleanup_codes[type_id] = ''.join(lines)
+	return incoming_cleanup_codes[type_id]
+
+outgoing_cleanup_codes: Dict[int, str] = dict()
+
+# returns the code that releases an outgoing wrapper's arguments when the call fails;
+# like incoming_cleanup_code(), this is only generated once per type
+def outgoing_cleanup_code(type: FunctionType) -> str:
+	type_id = type_to_id[type]
+
+	if type_id in outgoing_cleanup_codes:
+		return outgoing_cleanup_codes[type_id]
+
+	lines: List[str] = []
+
+	for index, param in enumerate(type.parameters):
+		if param.direction == Direction.OUT:
+			if isinstance(param.type, BasicType):
+				if type_is_refcounted(param.type.tag):
+					lines.append(f'\t\t_spookygen_{RELEASE_PREFIXES[param.type.tag]}_release_on_fail(arg{index}, arg{index}_should_cleanup_on_fail);\n')
+			elif isinstance(param.type, StructureType):
+				lines.extend([
+					f'\t\tif (arg{index} && arg{index}_should_cleanup_on_fail) {{\n',
+					f'\t\t\tspooky_release_object_with_type(arg{index}, _spookygen_types[{param.type_id}]);\n',
+					'\t\t}\n',
+				])
+			elif isinstance(param.type, FunctionType):
+				lines.extend([
+					f'\t\tif (arg{index}_invocation) {{\n',
+					f'\t\t\tspooky_release(arg{index}_invocation);\n',
+					'\t\t}\n',
+				])
+		else:
+			if isinstance(param.type, FunctionType):
+				lines.extend([
+					f'\t\tif (arg{index}_callback_context) {{\n',
+					f'\t\t\tLIBSPOOKY_WUR_IGNORE(sys_mempool_free(arg{index}_callback_context));\n',
+					'\t\t}\n',
+				])
+
+	outgoing_cleanup_codes[type_id] = ''.join(lines)
+	return outgoing_cleanup_codes[type_id]
+
+# i.e. for interface implementations or input callback implementations
+# invoked remotely by libspooky
+def write_incoming_function_wrapper(name: str, type: FunctionType, target_name: str | None, is_root_interface: bool, raw_name: str | None):
+	# the wrapper is put together in memory and written out in one go
+	lines: List[str] = []
+
+	lines.extend([
 		f'static void {name}(void* context, spooky_invocation_t* invocation) {{\n',
 		'\tferr_t status = ferr_ok;\n',
 		f'\t_spookygen_type_{type_to_id[type]}_f target = NULL;\n',
@@ -601,7 +844,7 @@ def write_incoming_function_wrapper(name: str, type: FunctionType, target_name:
 	])
 
 	if target_name == None:
-		source_file.writelines([
+		lines.extend([
 			'\tif (!invocation) {\n',
 			'\t\tLIBSPOOKY_WUR_IGNORE(sys_mempool_free(context));\n',
 			'\t\treturn;\n',
@@ -612,7 +855,7 @@ def write_incoming_function_wrapper(name: str, type: FunctionType, target_name:
 			'\tLIBSPOOKY_WUR_IGNORE(sys_mempool_free(context));\n\n',
 		])
 	elif not is_root_interface:
-		source_file.writelines([
+		lines.extend([
 			'\tif (!invocation) {\n',
 			'\t\treturn;\n',
 			'\t}\n',
@@ -621,7 +864,7 @@ def write_incoming_function_wrapper(name: str, type: FunctionType, target_name:
 			f'\ttarget_context = (({interface.name}_proxy_info_t*)context)->context;\n',
 		])
 	else:
-		source_file.writelines([
+		lines.extend([
 			'\tif (!invocation) {\n',
 			'\t\treturn;\n',
 			'\t}\n',
@@ -633,68 +876,58 @@ def write_incoming_function_wrapper(name: str, type: FunctionType, target_name:
 	for index, param in enumerate(type.parameters):
 		if isinstance(param.type, BasicType):
 			init_str = " = NULL" if type_is_refcounted(param.type.tag) else ""
-			source_file.write(f'\t{BASIC_TYPE_TAG_TO_NATIVE_TYPE[param.type.tag]} arg{index}{init_str};\n')
+			lines.append(f'\t{BASIC_TYPE_TAG_TO_NATIVE_TYPE[param.type.tag]} arg{index}{init_str};\n')
 			if param.direction == Direction.IN:
-				retain_arg = ", false" if type_is_refcounted(param.type.tag) else ""
-				source_file.writelines([
+				retain_arg = INCOMING_RETAIN_ARGS[param.type.tag]
+				lines.extend([
 					f'\tstatus = spooky_invocation_get_{param.type.tag.name}(invocation, {index}{retain_arg}, &arg{index});\n',
-					'\tif (status != ferr_ok) {\n',
-					'\t\tgoto out;\n',
-					'\t}\n',
+					CHECK_STATUS,
 				])
 		elif isinstance(param.type, StructureType):
-			source_file.write(f'\tstruct _spookygen_struct_{param.type_id} arg{index};\n')
+			lines.append(f'\tstruct _spookygen_struct_{param.type_id} arg{index};\n')
 			if param.direction == Direction.IN:
-				source_file.writelines([
+				lines.extend([
 					f'\tsize_t arg{index}_size = sizeof(arg{index});\n',
 					f'\tstatus = spooky_invocation_get_structure(invocation, {index}, false, &arg{index}, &arg{index}_size);\n',
-					'\tif (status != ferr_ok) {\n',
-					'\t\tgoto out;\n',
-					'\t}\n',
+					CHECK_STATUS,
 				])
 			else:
-				source_file.write(f'\tsimple_memset(&arg{index}, 0, sizeof(arg{index}));\n')
+				lines.append(f'\tsimple_memset(&arg{index}, 0, sizeof(arg{index}));\n')
 		elif isinstance(param.type, FunctionType):
 			if param.direction == Direction.IN:
-				source_file.writelines([
+				lines.extend([
 					f'\tspooky_invocation_t* arg{index}_invocation = NULL;\n',
 					f'\tstatus = spooky_invocation_get_invocation(invocation, {index}, &arg{index}_invocation);\n',
-					'\tif (status != ferr_ok) {\n',
-					'\t\tgoto out;\n',
-					'\t}\n',
+					CHECK_STATUS,
 				])
 			else:
-				source_file.writelines([
+				lines.extend([
 					f'\tstruct _spookygen_callback_context* arg{index}_callback_context = NULL;\n',
 					f'\tstatus = sys_mempool_allocate(sizeof(*arg{index}_callback_context), NULL, (void*)&arg{index}_callback_context);\n',
-					'\tif (status != ferr_ok) {\n',
-					'\t\tgoto out;\n',
-					'\t}\n',
+					CHECK_STATUS,
 					f'\targ{index}_callback_context->target = NULL;\n',
 					f'\targ{index}_callback_context->target_context = NULL;\n',
 				])
 
-	source_file.write('\tstatus = target(target_context')
+	lines.append('\tstatus = target(target_context')
 
 	for index, param in enumerate(type.parameters):
 		is_input = param.direction == Direction.IN
 		output_addr_of = '' if is_input else '&'
 		if isinstance(param.type, BasicType):
-			source_file.write(f', {output_addr_of}arg{index}')
+			lines.append(f', {output_addr_of}arg{index}')
 		elif isinstance(param.type, StructureType):
-			source_file.write(f', &arg{index}')
+			lines.append(f', &arg{index}')
 		elif isinstance(param.type, FunctionType):
 			if is_input:
-				source_file.write(f', _spookygen_callback_{param.type_id}, arg{index}_invocation')
+				lines.append(f', _spookygen_callback_{param.type_id}, arg{index}_invocation')
 			else:
-				source_file.write(f', (void*)&arg{index}_callback_context->target, &arg{index}_callback_context->target_context')
+				lines.append(f', (void*)&arg{index}_callback_context->target, &arg{index}_callback_context->target_context')
 
-	source_file.write(');\n\n')
+	lines.append(');\n\n')
 
-	source_file.writelines([
-		'\tif (status != ferr_ok) {\n',
-		'\t\tgoto out;\n',
-		'\t}\n',
+	lines.extend([
+		CHECK_STATUS,
 	])
 
 	for index, param in enumerate(type.parameters):
@@ -702,36 +935,28 @@ def write_incoming_function_wrapper(name: str, type: FunctionType, target_name:
 			continue
 
 		if isinstance(param.type, BasicType):
-			source_file.writelines([
+			lines.extend([
 				f'\tstatus = spooky_invocation_set_{param.type.tag.name}(invocation, {index}, arg{index});\n',
-				'\tif (status != ferr_ok) {\n',
-				'\t\tgoto out;\n',
-				'\t}\n',
+				CHECK_STATUS,
 			])
 			if type_is_consumed(param.type.tag):
 				# consumed upon successfully setting it
-				source_file.write(f'\targ{index} = NULL;\n')
+				lines.append(f'\targ{index} = NULL;\n')
 		elif isinstance(param.type, StructureType):
-			source_file.writelines([
+			lines.extend([
 				f'\tstatus = spooky_invocation_set_structure(invocation, {index}, &arg{index});\n',
-				'\tif (status != ferr_ok) {\n',
-				'\t\tgoto out;\n',
-				'\t}\n',
+				CHECK_STATUS,
 			])
 		elif isinstance(param.type, FunctionType):
-			source_file.writelines([
+			lines.extend([
 				f'\tstatus = spooky_invocation_set_function(invocation, {index}, _spookygen_callback_handler_{param.type_id}, arg{index}_callback_context);\n',
-				'\tif (status != ferr_ok) {\n',
-				'\t\tgoto out;\n',
-				'\t}\n',
+				CHECK_STATUS,
 				'\targ{index}_callback_context = NULL;\n',
 			])
 
-	source_file.writelines([
+	lines.extend([
 		'\tstatus = spooky_invocation_complete(invocation);\n',
-		'\tif (status != ferr_ok) {\n',
-		'\t\tgoto out;\n',
-		'\t}\n',
+		CHECK_STATUS,
 		'\n',
 		'out:\n',
 		'\tif (status != ferr_ok) {\n',
@@ -741,69 +966,26 @@ def write_incoming_function_wrapper(name: str, type: FunctionType, target_name:
 		'\tspooky_release(invocation);\n',
 	])
 
-	for index, param in enumerate(type.parameters):
-		if param.direction == Direction.IN:
-			#if isinstance(param.type, FunctionType):
-			#	source_file.writelines([
-			#		'\n',
-			#		f'\tif (arg{index}_invocation) {{\n',
-			#		f'\t\tspooky_release(arg{index}_invocation);\n',
-			#		'\t}\n',
-			#		'\n',
-			#	])
-			pass
-		else:
-			if isinstance(param.type, BasicType):
-				if type_is_refcounted(param.type.tag):
-					source_file.writelines([
-						f'\tif (arg{index}) {{\n',
-						f'\t\t{"sys" if type_is_libsys(param.type.tag) else "spooky"}_release(arg{index});\n',
-						'\t}\n',
-					])
-			elif isinstance(param.type, StructureType):
-				source_file.write(f'\tspooky_release_object_with_type(&arg{index}, _spookygen_types[{param.type_id}]);\n')
-			elif isinstance(param.type, FunctionType):
-				source_file.writelines([
-					'\n',
-					f'\tif (arg{index}_callback_context) {{\n',
-					'\t\t// TODO: cleanup target context somehow\n',
-					f'\t\tLIBSPOOKY_WUR_IGNORE(sys_mempool_free(arg{index}_callback_context));\n',
-					'\t}\n',
-					'\n',
-				])
+	lines.append(incoming_cleanup_code(type))
 
-	source_file.writelines([
+	lines.extend([
 		'};\n\n',
 	])
 
+	source_file.write(''.join(lines))
+
 # i.e. for output callback implementations
 # invoked directly by users
 def write_outgoing_function_wrapper(name: str, type: FunctionType, target_name: str | None, is_root_interface: bool, raw_name: str | None):
-	if name in written_names:
-		return
+	lines: List[str] = []
 
-	written_names.add(name)
+	params = generic_parameters(type.parameters)
 
-	params = copy.deepcopy(type.parameters)
+	lines.append(f'static ferr_t {name}(void* context{generic_signature(type)}) {{\n')
+	lines.append('\tferr_t status = ferr_ok;\n')
+	lines.append('\tspooky_invocation_t* invocation = context;\n')
 
-	for index, param in enumerate(params):
-		param.name = f'arg{index}'
-		write_function_type(param.type)
-
-	for index, param in enumerate(params):
-		if isinstance(param.type, FunctionType):
-			if param.direction == Direction.IN:
-				write_incoming_function_wrapper(f'_spookygen_callback_handler_{param.type_id}', param.type, None, False, None)
-			else:
-				write_outgoing_function_wrapper(f'_spookygen_callback_{param.type_id}', param.type, None, False, None)
-
-	source_file.write(f'static ferr_t {name}(void* context')
-	write_parameters(source_file, '', params, False, True)
-	source_file.write(') {\n')
-	source_file.write('\tferr_t status = ferr_ok;\n')
-	source_file.write('\tspooky_invocation_t* invocation = context;\n')
-
-	source_file.writelines([
+	lines.extend([
 		'\n',
 		'\t_spookygen_ensure_init();\n',
 		'\n',
@@ -818,7 +1000,7 @@ def write_outgoing_function_wrapper(name: str, type: FunctionType, target_name:
 		# the context is either an optional invocation to use or a proxy.
 		# if it's not an invocation, we have to create the invocation ourselves.
 
-		source_file.writelines([
+		lines.extend([
 			'\tif (invocation && spooky_object_class(invocation) != spooky_object_class_invocation()) {\n',
 			'\t\tinvocation = NULL;\n',
 			'\t}\n',
@@ -828,15 +1010,13 @@ def write_outgoing_function_wrapper(name: str, type: FunctionType, target_name:
 		assert raw_name != None
 
 		if not is_root_interface:
-			source_file.writelines([
-				f'\tstatus = spooky_invocation_create_proxy({json.dumps(raw_name)}, {len(raw_name)}, _spookygen_types[{type_to_id[type]}], context, &invocation);\n',
-				'\tif (status != ferr_ok) {\n',
-				'\t\tgoto out;\n',
-				'\t}\n',
+			lines.extend([
+				f'\tstatus = spooky_invocation_create_proxy({c_string_literal(raw_name)}, {len(raw_name)}, _spookygen_types[{type_to_id[type]}], context, &invocation);\n',
+				CHECK_STATUS,
 				'\n',
 			])
 		else:
-			source_file.writelines([
+			lines.extend([
 				'\tif (!invocation) {\n',
 				'\t\teve_channel_t* channel = NULL;\n',
 				'\t\tsys_mutex_lock(&_spookygen_client_mutex);\n',
@@ -844,16 +1024,16 @@ def write_outgoing_function_wrapper(name: str, type: FunctionType, target_name:
 			])
 
 			if default_server_name == None:
-				source_file.write('\t\t\tsys_abort();\n')
+				lines.append('\t\t\tsys_abort();\n')
 			else:
-				source_file.writelines([
-					f'\t\t\tstatus = {root_interface_name}_init_explicit_locked({json.dumps(default_server_name)}, {len(default_server_name)}, eve_loop_get_main());\n',
+				lines.extend([
+					f'\t\t\tstatus = {root_interface_name}_init_explicit_locked({c_string_literal(default_server_name)}, {len(default_server_name)}, eve_loop_get_main());\n',
 					'\t\t\tif (status != ferr_ok) {\n',
 					'\t\t\t\tgoto out;\n',
 					'\t\t\t}\n',
 				])
 
-			source_file.writelines([
+			lines.extend([
 				'\t\t}\n',
 				'\t\tchannel = _spookygen_channel;\n',
 				'\t\tstatus = eve_retain(channel);\n',
@@ -861,7 +1041,7 @@ def write_outgoing_function_wrapper(name: str, type: FunctionType, target_name:
 				'\t\t\tgoto out;\n',
 				'\t\t}\n',
 				'\t\tsys_mutex_unlock(&_spookygen_client_mutex);\n',
-				f'\t\tstatus = spooky_invocation_create({json.dumps(raw_name)}, {len(raw_name)}, _spookygen_types[{type_to_id[type]}], channel, &invocation);\n',
+				f'\t\tstatus = spooky_invocation_create({c_string_literal(raw_name)}, {len(raw_name)}, _spookygen_types[{type_to_id[type]}], channel, &invocation);\n',
 				'\t\teve_release(channel);\n',
 				'\t\tif (status != ferr_ok) {\n',
 				'\t\t\tgoto out;\n',
@@ -875,44 +1055,34 @@ def write_outgoing_function_wrapper(name: str, type: FunctionType, target_name:
 			continue
 
 		if isinstance(param.type, BasicType):
-			source_file.writelines([
+			lines.extend([
 				f'\tstatus = spooky_invocation_set_{param.type.tag.name}(invocation, {index}, arg{index});\n',
-				'\tif (status != ferr_ok) {\n',
-				'\t\tgoto out;\n',
-				'\t}\n',
+				CHECK_STATUS,
 			])
 			if type_is_consumed(param.type.tag):
 				# consumed upon successfully setting it
-				source_file.write(f'\targ{index} = NULL;\n')
+				lines.append(f'\targ{index} = NULL;\n')
 		elif isinstance(param.type, StructureType):
-			source_file.writelines([
+			lines.extend([
 				f'\tstatus = spooky_invocation_set_structure(invocation, {index}, arg{index});\n',
-				'\tif (status != ferr_ok) {\n',
-				'\t\tgoto out;\n',
-				'\t}\n',
+				CHECK_STATUS,
 			])
 		elif isinstance(param.type, FunctionType):
-			source_file.writelines([
+			lines.extend([
 				f'\tstruct _spookygen_callback_context* arg{index}_callback_context = NULL;\n',
 				f'\tstatus = sys_mempool_allocate(sizeof(*arg{index}_callback_context), NULL, (void*)&arg{index}_callback_context);\n',
-				'\tif (status != ferr_ok) {\n',
-				'\t\tgoto out;\n',
-				'\t}\n',
+				CHECK_STATUS,
 				f'\targ{index}_callback_context->target = arg{index};\n',
 				f'\targ{index}_callback_context->target_context = _context_arg{index};\n',
 				f'\tstatus = spooky_invocation_set_function(invocation, {index}, _spookygen_callback_handler_{param.type_id}, arg{index}_callback_context));\n',
-				'\tif (status != ferr_ok) {\n',
-				'\t\tgoto out;\n',
-				'\t}\n',
+				CHECK_STATUS,
 				# the callback context is stored in the invocation and will be passed to the function upon cleanup of the invocation
 				f'\targ{index}_callback_context = NULL;\n'
 			])
 
-	source_file.writelines([
+	lines.extend([
 		'\tstatus = spooky_invocation_execute_sync(invocation);\n',
-		'\tif (status != ferr_ok) {\n',
-		'\t\tgoto out;\n',
-		'\t}\n',
+		CHECK_STATUS,
 	])
 
 	for index, param in enumerate(params):
@@ -920,37 +1090,31 @@ def write_outgoing_function_wrapper(name: str, type: FunctionType, target_name:
 			continue
 
 		if isinstance(param.type, BasicType):
-			retain_arg = ", true" if type_is_refcounted(param.type.tag) else ""
-			source_file.writelines([
+			retain_arg = OUTGOING_RETAIN_ARGS[param.type.tag]
+			lines.extend([
 				f'\tbool arg{index}_should_cleanup_on_fail = false;\n',
 				f'\tstatus = spooky_invocation_get_{param.type.tag.name}(invocation, {index}{retain_arg}, arg{index});\n',
-				'\tif (status != ferr_ok) {\n',
-				'\t\tgoto out;\n',
-				'\t}\n',
+				CHECK_STATUS,
 				f'\targ{index}_should_cleanup_on_fail = true;\n',
 			])
 		elif isinstance(param.type, StructureType):
-			source_file.writelines([
+			lines.extend([
 				f'\tsize_t arg{index}_size = sizeof(*arg{index});\n',
 				f'\tbool arg{index}_should_cleanup_on_fail = false;\n',
 				f'\tstatus = spooky_invocation_get_structure(invocation, {index}, true, arg{index}, &arg{index}_size);\n',
-				'\tif (status != ferr_ok) {\n',
-				'\t\tgoto out;\n',
-				'\t}\n',
+				CHECK_STATUS,
 				f'\targ{index}_should_cleanup_on_fail = true;\n',
 			])
 		elif isinstance(param.type, FunctionType):
-			source_file.writelines([
+			lines.extend([
 				f'\tspooky_invocation_t* arg{index}_invocation = NULL;\n',
 				f'\tstatus = spooky_invocation_get_invocation(invocation, {index}, &arg{index}_invocation);\n',
-				'\tif (status != ferr_ok) {\n',
-				'\t\tgoto out;\n',
-				'\t}\n',
+				CHECK_STATUS,
 				f'\t*arg{index} = _spookygen_callback_{param.type_id};\n',
 				f'\t*_context_arg{index} = arg{index}_invocation;\n',
 			])
 
-	source_file.writelines([
+	lines.extend([
 		'out:\n',
 		'\tif (invocation) {\n',
 		'\t\tspooky_release(invocation);\n',
@@ -959,42 +1123,17 @@ def write_outgoing_function_wrapper(name: str, type: FunctionType, target_name:
 		'\tif (status != ferr_ok) {\n',
 	])
 
-	for index, param in enumerate(params):
-		if param.direction == Direction.OUT:
-			if isinstance(param.type, BasicType):
-				if type_is_refcounted(param.type.tag):
-					source_file.writelines([
-						f'\t\tif (arg{index} && arg{index}_should_cleanup_on_fail) {{\n',
-						f'\t\t\t{"sys" if type_is_libsys(param.type.tag) else "spooky"}_release(*arg{index});\n',
-						'\t\t}\n',
-					])
-			elif isinstance(param.type, StructureType):
-				source_file.writelines([
-					f'\t\tif (arg{index} && arg{index}_should_cleanup_on_fail) {{\n',
-					f'\t\t\tspooky_release_object_with_type(arg{index}, _spookygen_types[{param.type_id}]);\n',
-					'\t\t}\n',
-				])
-			elif isinstance(param.type, FunctionType):
-				source_file.writelines([
-					f'\t\tif (arg{index}_invocation) {{\n',
-					f'\t\t\tspooky_release(arg{index}_invocation);\n',
-					'\t\t}\n',
-				])
-		else:
-			if isinstance(param.type, FunctionType):
-				source_file.writelines([
-					f'\t\tif (arg{index}_callback_context) {{\n',
-					f'\t\t\tLIBSPOOKY_WUR_IGNORE(sys_mempool_free(arg{index}_callback_context));\n',
-					'\t\t}\n',
-				])
+	lines.append(outgoing_cleanup_code(type))
 
-	source_file.writelines([
+	lines.extend([
 		'\t}\n',
 		'\n',
 		'\treturn status;\n',
 		'};\n\n',
 	])
 
+	source_file.write(''.join(lines))
+
 for interface in interfaces:
 	for function in interface.functions:
 		type = cast(FunctionType, id_to_type[function.type_id])
@@ -1002,34 +1141,40 @@ for interface in interfaces:
 		is_root_interface = interface.name == root_interface_name
 
 		if args.server or not is_root_interface:
-			write_incoming_function_wrapper(f'_spookygen_impl_{interface.name}_{function.name}', type, f'{interface.name}_{function.name}_impl', interface.name == root_interface_name, function.name)
+			write_function_wrapper(True, f'_spookygen_impl_{interface.name}_{function.name}', type, f'{interface.name}_{function.name}_impl', interface.name == root_interface_name, function.name)
 
 		if not args.server or not is_root_interface:
-			write_outgoing_function_wrapper(f'_spookygen_internal_{interface.name}_{function.name}', type, f'{interface.name}_{function.name}', interface.name == root_interface_name, function.name)
+			write_function_wrapper(False, f'_spookygen_internal_{interface.name}_{function.name}', type, f'{interface.name}_{function.name}', interface.name == root_interface_name, function.name)
+
+			prefix = f'{interface.name}_{function.name}'
 
-			source_file.write(f'SPOOKYGEN_{root_interface_name}_STORAGE ferr_t {interface.name}_{function.name}(void* _spookygen_context')
-			write_parameters(source_file, f'{interface.name}_{function.name}', function.parameters, False)
-			source_file.write(') {\n')
-			source_file.write(f'\treturn _spookygen_internal_{interface.name}_{function.name}(_spookygen_context')
+			# the public function's parameters and the arguments it forwards to the internal wrapper are built in the same pass
+			parameters: List[str] = []
+			arguments: List[str] = []
 			for param in function.parameters:
+				parameters.append(', ' + PARAMETER_FORMATTERS[param.type.__class__](prefix, param, False))
 				if isinstance(param.type, BasicType):
-					source_file.write(f', {param.name}')
+					arguments.append(f', {param.name}')
 				elif isinstance(param.type, StructureType):
 					const_str = "const " if param.direction == Direction.IN else ""
-					source_file.write(f', ({const_str}void*){param.name}')
+					arguments.append(f', ({const_str}void*){param.name}')
 				elif isinstance(param.type, FunctionType):
-					source_file.write(f', (void*){param.name}, _context_{param.name}')
-			source_file.write(');\n')
-			source_file.write('};\n\n')
+					arguments.append(f', (void*){param.name}, _context_{param.name}')
+
+			source_file.writelines([
+				f'{storage_macro} ferr_t {prefix}(void* _spookygen_context{"".join(parameters)}) {{\n',
+				f'\treturn _spookygen_internal_{prefix}(_spookygen_context{"".join(arguments)});\n',
+				'};\n\n',
+			])
 
 if args.server:
-	root_interface = [x for x in interfaces if x.name == root_interface_name][0]
+	root_interface = interfaces_by_name[root_interface_name]
 
 	header_file.write(f'spooky_interface_t* {root_interface_name}_interface(void);\n')
 	if default_server_name != None:
-		header_file.write(f'SPOOKYGEN_{root_interface_name}_STORAGE LIBSPOOKY_WUR ferr_t {root_interface_name}_serve(eve_loop_t* loop, eve_server_channel_t** out_server_channel);\n')
-	header_file.write(f'SPOOKYGEN_{root_interface_name}_STORAGE LIBSPOOKY_WUR ferr_t {root_interface_name}_serve_explicit(eve_loop_t* loop, sys_channel_t* server_channel);\n')
-	header_file.write(f'SPOOKYGEN_{root_interface_name}_STORAGE LIBSPOOKY_WUR ferr_t {root_interface_name}_detach(eve_loop_t* loop, eve_server_channel_t** out_server_channel);\n')
+		header_file.write(f'{storage_macro} LIBSPOOKY_WUR ferr_t {root_interface_name}_serve(eve_loop_t* loop, eve_server_channel_t** out_server_channel);\n')
+	header_file.write(f'{storage_macro} LIBSPOOKY_WUR ferr_t {root_interface_name}_serve_explicit(eve_loop_t* loop, sys_channel_t* server_channel);\n')
+	header_file.write(f'{storage_macro} LIBSPOOKY_WUR ferr_t {root_interface_name}_detach(eve_loop_t* loop, eve_server_channel_t** out_server_channel);\n')
 
 	source_file.writelines([
 		'static void _spookygen_server_handler(void* context, eve_server_channel_t* server_channel, sys_channel_t* channel) {\n',
@@ -1039,19 +1184,15 @@ if args.server:
 
 	if default_server_name != None:
 		source_file.writelines([
-			f'SPOOKYGEN_{root_interface_name}_STORAGE ferr_t {root_interface_name}_serve(eve_loop_t* loop, eve_channel_t** out_server_channel) {{\n',
+			f'{storage_macro} ferr_t {root_interface_name}_serve(eve_loop_t* loop, eve_channel_t** out_server_channel) {{\n',
 			'\tferr_t status = ferr_ok;\n',
 			'\tsys_channel_t* sys_server_channel = NULL;\n',
 			'\n',
-			f'\tstatus = sys_sysman_register_sync_n({json.dumps(default_server_name)}, {len(default_server_name)}, sys_sysman_realm_{default_realm.name.lower()}, &sys_server_channel);\n',
-			'\tif (status != ferr_ok) {\n',
-			'\t\tgoto out;\n'
-			'\t}\n',
+			f'\tstatus = sys_sysman_register_sync_n({c_string_literal(default_server_name)}, {len(default_server_name)}, sys_sysman_realm_{default_realm.name.lower()}, &sys_server_channel);\n',
+			CHECK_STATUS,
 			'\n',
 			f'\tstatus = {root_interface_name}_serve_explicit(loop, sys_server_channel);\n',
-			'\tif (status != ferr_ok) {\n',
-			'\t\tgoto out;\n'
-			'\t}\n',
+			CHECK_STATUS,
 			'\n',
 			'\tif (out_server_channel) {\n',
 			'\t\t// this cannot fail\n',
@@ -1069,7 +1210,7 @@ if args.server:
 		])
 
 	source_file.writelines([
-		f'SPOOKYGEN_{root_interface_name}_STORAGE ferr_t {root_interface_name}_detach(eve_loop_t* loop, eve_server_channel_t** out_server_channel) {{\n',
+		f'{storage_macro} ferr_t {root_interface_name}_detach(eve_loop_t* loop, eve_server_channel_t** out_server_channel) {{\n',
 		'\tferr_t status = ferr_ok;\n',
 		'\n',
 		'\t_spookygen_ensure_init();\n',
@@ -1082,9 +1223,7 @@ if args.server:
 		'\t}\n',
 		'\n',
 		'\tstatus = eve_loop_remove_item(loop, _spookygen_server_channel);\n',
-		'\tif (status != ferr_ok) {\n',
-		'\t\tgoto out;\n',
-		'\t}\n',
+		CHECK_STATUS,
 		'\n',
 		'\tif (out_server_channel) {\n',
 		'\t\t*out_server_channel = _spookygen_server_channel;\n',
@@ -1101,9 +1240,8 @@ if args.server:
 	])
 
 	source_file.writelines([
-		f'SPOOKYGEN_{root_interface_name}_STORAGE ferr_t {root_interface_name}_serve_explicit(eve_loop_t* loop, sys_channel_t* sys_server_channel) {{\n',
+		f'{storage_macro} ferr_t {root_interface_name}_serve_explicit(eve_loop_t* loop, sys_channel_t* sys_server_channel) {{\n',
 		'\tferr_t status = ferr_ok;\n',
-		f'\tspooky_interface_entry_t entries[{len(root_interface.functions)}];\n',
 		'\n',
 		'\t_spookygen_ensure_init();\n',
 		'\n',
@@ -1122,28 +1260,18 @@ if args.server:
 		'\n',
 	])
 
-	idx = 0
-	for function in root_interface.functions:
-		source_file.writelines([
-			f'\tentries[{idx}].name = {json.dumps(function.name)};\n',
-			f'\tentries[{idx}].name_length = {len(function.name)};\n',
-			f'\tentries[{idx}].function = _spookygen_types[{function.type_id}];\n',
-			f'\tentries[{idx}].implementation = _spookygen_impl_{root_interface_name}_{function.name};\n',
-			f'\tentries[{idx}].context = NULL;\n',
-		])
-		idx += 1
-
+	# the function types are only created by `_spookygen_ensure_init()`, so this can't be a static array;
+	# it's still emitted as a single initializer rather than assigning each member separately
+	source_file.write('\tspooky_interface_entry_t entries[] = {\n')
+	source_file.writelines([f'\t\t{{ .name = {c_string_literal(function.name)}, .name_length = {len(function.name)}, .function = _spookygen_types[{function.type_id}], .implementation = _spookygen_impl_{root_interface_name}_{function.name}, .context = NULL }},\n' for function in root_interface.functions])
 	source_file.writelines([
+		'\t};\n',
 		'\n',
 		f'\tstatus = spooky_interface_create(entries, {len(root_interface.functions)}, &_spookygen_interface);\n',
-		'\tif (status != ferr_ok) {\n',
-		'\t\tgoto out;\n'
-		'\t}\n',
+		CHECK_STATUS,
 		'\n',
 		'\tstatus = eve_server_channel_create(sys_server_channel, NULL, &_spookygen_server_channel);\n',
-		'\tif (status != ferr_ok) {\n',
-		'\t\tgoto out;\n'
-		'\t}\n',
+		CHECK_STATUS,
 		'\n',
 		'\tsys_release(sys_server_channel);\n',
 		'\tsys_server_channel = NULL;\n',
@@ -1169,13 +1297,13 @@ if args.server:
 	])
 else:
 	if default_server_name != None:
-		header_file.write(f'SPOOKYGEN_{root_interface_name}_STORAGE LIBSPOOKY_WUR ferr_t {root_interface_name}_init(eve_loop_t* loop);\n')
-	header_file.write(f'SPOOKYGEN_{root_interface_name}_STORAGE LIBSPOOKY_WUR ferr_t {root_interface_name}_init_explicit(const char* name, size_t name_length, eve_loop_t* loop);\n')
+		header_file.write(f'{storage_macro} LIBSPOOKY_WUR ferr_t {root_interface_name}_init(eve_loop_t* loop);\n')
+	header_file.write(f'{storage_macro} LIBSPOOKY_WUR ferr_t {root_interface_name}_init_explicit(const char* name, size_t name_length, eve_loop_t* loop);\n')
 
 	if default_server_name != None:
 		source_file.writelines([
-			f'SPOOKYGEN_{root_interface_name}_STORAGE ferr_t {root_interface_name}_init(eve_loop_t* loop) {{\n',
-			f'\treturn {root_interface_name}_init_explicit({json.dumps(default_server_name)}, {len(default_server_name)}, loop);\n',
+			f'{storage_macro} ferr_t {root_interface_name}_init(eve_loop_t* loop) {{\n',
+			f'\treturn {root_interface_name}_init_explicit({c_string_literal(default_server_name)}, {len(default_server_name)}, loop);\n',
 			'};\n\n',
 		])
 
@@ -1214,14 +1342,10 @@ else:
 		'\t}\n',
 		'\n',
 		'\tstatus = sys_channel_connect_sync_n(name, name_length, &sys_channel);',
-		'\tif (status != ferr_ok) {\n',
-		'\t\tgoto out;\n'
-		'\t}\n',
+		CHECK_STATUS,
 		'\n',
 		'\tstatus = eve_channel_create(sys_channel, NULL, &_spookygen_channel);\n',
-		'\tif (status != ferr_ok) {\n',
-		'\t\tgoto out;\n'
-		'\t}\n',
+		CHECK_STATUS,
 		'\n',
 		'\tsys_release(sys_channel);\n',
 		'\tsys_channel = NULL;\n',
@@ -1249,7 +1373,7 @@ else:
 	])
 
 	source_file.writelines([
-		f'SPOOKYGEN_{root_interface_name}_STORAGE ferr_t {root_interface_name}_init_explicit(const char* name, size_t name_length, eve_loop_t* loop) {{\n',
+		f'{storage_macro} ferr_t {root_interface_name}_init_explicit(const char* name, size_t name_length, eve_loop_t* loop) {{\n',
 		f'\tsys_mutex_lock(&_spookygen_client_mutex);\n',
 		f'\tferr_t status = {root_interface_name}_init_explicit_locked(name, name_length, loop);\n',
 		'\tsys_mutex_unlock(&_spookygen_client_mutex);\n',
@@ -1261,7 +1385,7 @@ for interface in interfaces:
 	if interface.name == root_interface_name:
 		continue
 
-	header_file.write(f'\nSPOOKYGEN_{root_interface_name}_STORAGE LIBSPOOKY_WUR ferr_t {interface.name}_create_proxy(const {interface.name}_proxy_info_t* info, spooky_proxy_t** out_proxy);\n')
+	header_file.write(f'\n{storage_macro} LIBSPOOKY_WUR ferr_t {interface.name}_create_proxy(const {interface.name}_proxy_info_t* info, spooky_proxy_t** out_proxy);\n')
 
 	source_file.writelines([
 		f'static void {interface.name}_proxy_destructor(void* context) {{\n',
@@ -1274,44 +1398,30 @@ for interface in interfaces:
 	])
 
 	source_file.writelines([
-		f'SPOOKYGEN_{root_interface_name}_STORAGE LIBSPOOKY_WUR ferr_t {interface.name}_create_proxy(const {interface.name}_proxy_info_t* info, spooky_proxy_t** out_proxy) {{\n',
+		f'{storage_macro} LIBSPOOKY_WUR ferr_t {interface.name}_create_proxy(const {interface.name}_proxy_info_t* info, spooky_proxy_t** out_proxy) {{\n',
 		'\tferr_t status = ferr_ok;\n',
 		f'\tspooky_proxy_interface_t* proxy_interface = NULL;\n',
-		f'\tspooky_proxy_interface_entry_t entries[{len(interface.functions)}];\n',
 		f'\t{interface.name}_proxy_info_t* copy = NULL;\n',
 		'\n',
 		'\t_spookygen_ensure_init();\n',
 		'\n',
 		'\tstatus = sys_mempool_allocate(sizeof(*copy), NULL, (void*)&copy);\n',
-		'\tif (status != ferr_ok) {\n',
-		'\t\tgoto out;\n',
-		'\t}\n',
+		CHECK_STATUS,
 		'\n',
 		'\tsimple_memcpy(copy, info, sizeof(*copy));\n',
 		'\n',
 	])
 
-	idx = 0
-	for function in interface.functions:
-		source_file.writelines([
-			f'\tentries[{idx}].name = {json.dumps(function.name)};\n',
-			f'\tentries[{idx}].name_length = {len(function.name)};\n',
-			f'\tentries[{idx}].function = _spookygen_types[{function.type_id}];\n',
-			f'\tentries[{idx}].implementation = _spookygen_impl_{interface.name}_{function.name};\n',
-		])
-		idx += 1
-
+	source_file.write('\tspooky_proxy_interface_entry_t entries[] = {\n')
+	source_file.writelines([f'\t\t{{ .name = {c_string_literal(function.name)}, .name_length = {len(function.name)}, .function = _spookygen_types[{function.type_id}], .implementation = _spookygen_impl_{interface.name}_{function.name} }},\n' for function in interface.functions])
 	source_file.writelines([
+		'\t};\n',
 		'\n',
 		f'\tstatus = spooky_proxy_interface_create(entries, {len(interface.functions)}, &proxy_interface);\n',
-		'\tif (status != ferr_ok) {\n',
-		'\t\tgoto out;\n',
-		'\t}\n',
+		CHECK_STATUS,
 		'\n',
 		f'\tstatus = spooky_proxy_create(proxy_interface, copy, {interface.name}_proxy_destructor, out_proxy);\n',
-		'\tif (status != ferr_ok) {\n',
-		'\t\tgoto out;\n',
-		'\t}\n',
+		CHECK_STATUS,
 		'\n',
 		'out:\n',
 		'\tif (status == ferr_ok) {\n',
@@ -1330,5 +1440,6 @@ for interface in interfaces:
 		'};\n\n',
 	])
 
-source_file.close()
-header_file.close()
+# leave the outputs untouched if nothing changed, so the code that includes or compiles them isn't rebuilt for nothing
+anillo_util.write_if_changed(args.source, source_file.getvalue())
+anillo_util.write_if_changed(args.header, header_file.getvalue())
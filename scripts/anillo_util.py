@@ -1,6 +1,11 @@
 import os
+import io
+import json
 import errno
 import subprocess
+import hashlib
+import shutil
+import tempfile
 
 # from https://stackoverflow.com/a/600612/6620880
 def mkdir_p(path):
@@ -10,17 +15,117 @@ def mkdir_p(path):
 		if not (exc.errno == errno.EEXIST and os.path.isdir(path)):
 			raise
 
-# adapted from https://stackoverflow.com/a/53808695/6620880
-def to_padded_hex(value, hex_digits=2):
-	return '0x{0:0{1}x}'.format(value if isinstance(value, int) else ord(value), hex_digits)
-
-def to_c_array(array_name, values, array_type='uint8_t', formatter=to_padded_hex, column_count=8, static=True):
-	if len(values) == 0:
-		return '{}{} {}[] = {{}};\n'.format('static ' if static else '', array_type, array_name)
-	values = [formatter(v) for v in values]
-	rows = [values[i:i + column_count] for i in range(0, len(values), column_count)]
-	body = ',\n\t'.join([', '.join(r) for r in rows])
-	return '{}{} {}[] = {{\n\t{},\n}};\n'.format('static ' if static else '', array_type, array_name, body)
+# returns C code declaring `array_name` as a global array of `array_type` holding `data`.
+# the array itself is defined by the assembly from `to_incbin_assembly`, which must be built into exactly one object file.
+def to_c_extern_array(array_name, data, array_type='uint8_t', element_size=1):
+	return 'extern const {} {}[{}];\n'.format(array_type, array_name, len(data) // element_size)
+
+# returns kernel assembly source (to be built as a `.S` file) defining `array_name` in read-only data, with its contents (`data`)
+# embedded by the assembler straight from the file `name`. `name` is looked up in the assembler's include paths, so the directory
+# containing it has to be added as an include directory for the assembly file (this keeps absolute paths out of the generated code).
+# this is far cheaper to build than the same data written out as a C array initializer. the digest of the data is included so that
+# the source gets reassembled whenever the data changes (the build system itself doesn't know about the embedded file).
+def to_incbin_assembly(array_name, name, data, alignment=16):
+	return '// sha256: {}\n\n#include <ferro/asm/common.hS>\n\n#ifdef FERRO_MACHO\n.const\n#else\n.section .rodata\n#endif\n\n.balign {}\n.global FERRO_SYM({})\nFERRO_SYM({}):\n\t.incbin {}\n'.format(hashlib.sha256(data).hexdigest(), alignment, array_name, array_name, json.dumps(name))
+
+# writes `content` to `path` unless the file already has the same content, so that build steps depending on the file
+# aren't triggered when nothing actually changed. `content` is either a string (compared ignoring surrounding whitespace)
+# or a bytes-like object (compared exactly and written as-is).
+# the content is written to a temporary file next to `path` and then renamed over it, so an interrupted write
+# never leaves a truncated file behind for the build system to mistake for an up-to-date output.
+# returns whether the file was written.
+def write_if_changed(path, content):
+	binary = not isinstance(content, str)
+
+	if os.path.exists(path):
+		if binary:
+			with open(path, 'rb') as file:
+				if memoryview(content).cast('B') == file.read():
+					return False
+		else:
+			with io.open(path, 'r', newline='\n') as file:
+				if file.read().strip() == content.strip():
+					return False
+
+	fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+	try:
+		# `mkstemp` always creates the file as owner-only; give it the permissions a normally created file would have
+		umask = os.umask(0)
+		os.umask(umask)
+		os.fchmod(fd, 0o666 & ~umask)
+
+		if binary:
+			with io.open(fd, 'wb') as file:
+				file.write(content)
+		else:
+			with io.open(fd, 'w', newline='\n') as file:
+				file.write(content)
+
+		os.replace(temp_path, path)
+	except BaseException:
+		try:
+			os.unlink(temp_path)
+		except OSError:
+			pass
+		raise
+
+	return True
+
+# returns the list of prerequisites in a Make-style depfile
+def read_depfile(path):
+	with open(path, 'r', newline='\n') as depfile:
+		return depfile.read().replace('\\\n', ' ').split(':', 1)[-1].split()
+
+# computes a digest of everything that can affect the output of `command`: the identity of the executable,
+# the arguments, and the contents of `input_paths` plus every prerequisite listed in `depfile_path` (if it exists).
+# returns `None` if the digest can't be computed (e.g. because one of the inputs no longer exists).
+def compute_inputs_digest(command, input_paths, depfile_path=None):
+	digest = hashlib.sha256()
+
+	executable_path = shutil.which(command[0])
+	if executable_path == None:
+		return None
+	executable_stat = os.stat(executable_path)
+	digest.update('{}\0{}\0{}\0'.format(os.path.realpath(executable_path), executable_stat.st_size, executable_stat.st_mtime_ns).encode())
+
+	for arg in command[1:]:
+		digest.update((arg + '\0').encode())
+
+	paths = list(input_paths)
+	if depfile_path != None and os.path.exists(depfile_path):
+		paths += read_depfile(depfile_path)
+
+	for path in paths:
+		try:
+			with open(path, 'rb') as file:
+				digest.update(path.encode() + b'\0' + file.read())
+		except OSError:
+			return None
+
+	return digest.hexdigest()
+
+# checks whether the outputs of a previous run of `command` can be reused as-is: all of `output_paths` must exist
+# and the digest recorded in `key_path` (by `save_inputs_digest`) must still match the current inputs
+def outputs_up_to_date(key_path, command, input_paths, depfile_path, output_paths):
+	if not all(os.path.exists(x) for x in [key_path, *output_paths]):
+		return False
+
+	digest = compute_inputs_digest(command, input_paths, depfile_path)
+	if digest == None:
+		return False
+
+	with io.open(key_path, 'r', newline='\n') as keyfile:
+		return keyfile.read().strip() == digest
+
+# records the digest of the inputs of `command` in `key_path` for the next `outputs_up_to_date` check.
+# this should be called after the depfile has been written, since its prerequisites are part of the digest.
+def save_inputs_digest(key_path, command, input_paths, depfile_path=None):
+	digest = compute_inputs_digest(command, input_paths, depfile_path)
+	if digest == None:
+		return
+
+	with io.open(key_path, 'w', newline='\n') as keyfile:
+		keyfile.write(digest)
 
 def run_or_fail(command, print_on_fail=True, cwd=None):
 	output = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=cwd)
@@ -3,54 +3,16 @@
 from dataclasses import dataclass
 import os
 import argparse
-from sys import stderr, stdout
+from sys import stderr
 from typing import Dict, List
 import subprocess
 import re
 import io
-import hashlib
 import anillo_util
 import json
 
 SCRIPT_DIR = os.path.dirname(__file__)
 
-argparser = argparse.ArgumentParser()
-argparser.add_argument('-a', '--arch', required=True, choices=['x86_64', 'aarch64'], help='The architecture to generate offsets for')
-argparser.add_argument('-s', '--source', required=True, help='A path for the input source file to use to generate offsets')
-argparser.add_argument('-H', '--header', required=True, help='A path for the resulting header file')
-argparser.add_argument('-j', '--json', help='A path for the resulting JSON file. If omitted, no JSON file will be created')
-argparser.add_argument('-d', '--depfile', help='A path for the resulting dependency list file. If omitted, no dependency list file will be created')
-argparser.add_argument('compiler_args', nargs='*', help='A list of arguments to pass to the compiler')
-args = argparser.parse_args()
-
-arch: str = args.arch
-source: str = os.path.abspath(args.source)
-header: str = os.path.abspath(args.header)
-jsonpath: str | None = args.json
-if jsonpath != None:
-	jsonpath = os.path.abspath(jsonpath)
-depfile: str | None = args.depfile
-if depfile != None:
-	depfile = os.path.abspath(depfile)
-compiler_args: List[str] = args.compiler_args
-
-compiler_args.append(f'-I{os.path.join(SCRIPT_DIR, "include")}')
-
-result = subprocess.run([
-	'clang',
-	'-o-',
-	'-ffreestanding',
-	'-nostdlib',
-	'-target',
-	f'{arch}-unknown-darwin-macho',
-	'-S',
-	source,
-	*compiler_args
-], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=stderr)
-result.check_returncode()
-
-output = result.stdout.decode('utf-8')
-
 @dataclass
 class Offset:
 	struct: str
@@ -62,81 +24,107 @@ class Size:
 	struct: str
 	size: int
 
-SIZE_REGEX = r'(?:##|;) XXX ([A-Za-z_][A-Za-z_0-9]*) = ([0-9]+)'
-OFFSET_REGEX = r'(?:##|;) XXX ([A-Za-z_][A-Za-z_0-9]*) XXX ([A-Za-z_][A-Za-z_0-9]*) = ([0-9]+)'
-
-sizes = [Size(x.group(1), int(x.group(2))) for x in re.finditer(SIZE_REGEX, output)]
-offsets = [Offset(x.group(1), x.group(2), int(x.group(3))) for x in re.finditer(OFFSET_REGEX, output)]
-
-header_contents = '#pragma once\n\n'
+SIZE_REGEX = re.compile(r'(?:##|;) XXX ([A-Za-z_][A-Za-z_0-9]*) = ([0-9]+)')
+OFFSET_REGEX = re.compile(r'(?:##|;) XXX ([A-Za-z_][A-Za-z_0-9]*) XXX ([A-Za-z_][A-Za-z_0-9]*) = ([0-9]+)')
+
+def main():
+	argparser = argparse.ArgumentParser()
+	argparser.add_argument('-a', '--arch', required=True, choices=['x86_64', 'aarch64'], help='The architecture to generate offsets for')
+	argparser.add_argument('-s', '--source', required=True, help='A path for the input source file to use to generate offsets')
+	argparser.add_argument('-H', '--header', required=True, help='A path for the resulting header file')
+	argparser.add_argument('-j', '--json', help='A path for the resulting JSON file. If omitted, no JSON file will be created')
+	argparser.add_argument('-d', '--depfile', help='A path for the resulting dependency list file. If omitted, no dependency list file will be created')
+	argparser.add_argument('compiler_args', nargs='*', help='A list of arguments to pass to the compiler')
+	args = argparser.parse_args()
+
+	arch: str = args.arch
+	source: str = os.path.abspath(args.source)
+	header: str = os.path.abspath(args.header)
+	jsonpath: str | None = args.json
+	if jsonpath != None:
+		jsonpath = os.path.abspath(jsonpath)
+	depfile: str | None = args.depfile
+	if depfile != None:
+		depfile = os.path.abspath(depfile)
+	compiler_args: List[str] = args.compiler_args
+
+	compiler_args.append(f'-I{os.path.join(SCRIPT_DIR, "include")}')
+
+	# if we need a dependency list, have clang generate it as part of the same invocation
+	depfile_args = []
+
+	if depfile != None:
+		depfile_args = ['-MD', '-MF', depfile + '.tmp', '-MT', os.path.splitext(os.path.basename(source))[0] + '.o']
+
+	command = [
+		'clang',
+		'-o-',
+		'-ffreestanding',
+		'-nostdlib',
+		'-target',
+		f'{arch}-unknown-darwin-macho',
+		'-S',
+		*depfile_args,
+		source,
+		*compiler_args
+	]
 
-for size in sizes:
-	header_contents += f'#define FLAYOUT_{size.struct}_SIZE {size.size}\n'
+	# without a depfile, we can't know which headers the source depends on, so we can only cache results when we have one.
+	# the key covers the exact command that gets run, so changing any of its flags invalidates it.
+	cache_key_path = header + '.key'
+	# this script and `anillo_util` determine how the compiler output is turned into the outputs, so they're inputs too
+	cache_inputs = [source, os.path.abspath(__file__), anillo_util.__file__]
 
-for offset in offsets:
-	header_contents += f'#define FOFFSET_{offset.struct}_{offset.member} {offset.offset}\n'
+	if depfile != None and anillo_util.outputs_up_to_date(cache_key_path, command, cache_inputs, depfile, [header, depfile] + ([jsonpath] if jsonpath != None else [])):
+		return
 
-write_header = False
+	if depfile != None:
+		anillo_util.mkdir_p(os.path.dirname(depfile))
 
-anillo_util.mkdir_p(os.path.dirname(header))
+	result = subprocess.run(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=stderr)
+	result.check_returncode()
 
-if os.path.exists(header):
-	with io.open(header, 'r', newline='\n') as outfile:
-		file_content = outfile.read().strip()
-		if hashlib.sha256(header_contents.strip().encode()).hexdigest() != hashlib.sha256(file_content.encode()).hexdigest():
-			write_header = True
-else:
-	write_header = True
+	output = result.stdout.decode('utf-8')
 
-if write_header:
-	with io.open(header, 'w', newline='\n') as outfile:
-		outfile.write(header_contents)
+	sizes = [Size(x.group(1), int(x.group(2))) for x in SIZE_REGEX.finditer(output)]
+	offsets = [Offset(x.group(1), x.group(2), int(x.group(3))) for x in OFFSET_REGEX.finditer(output)]
 
-if jsonpath != None:
-	data = {}
+	header_lines = ['#pragma once\n\n']
 
 	for size in sizes:
-		data[size.struct] = { 'size': size.size, 'layout': {} }
+		header_lines.append(f'#define FLAYOUT_{size.struct}_SIZE {size.size}\n')
 
 	for offset in offsets:
-		if not (offset.struct in data):
-			data[offset.struct] = { 'size': None, 'layout': {} }
+		header_lines.append(f'#define FOFFSET_{offset.struct}_{offset.member} {offset.offset}\n')
 
-		data[offset.struct]['layout'][offset.member] = offset.offset
+	header_contents = ''.join(header_lines)
 
-	anillo_util.mkdir_p(os.path.dirname(jsonpath))
+	anillo_util.mkdir_p(os.path.dirname(header))
+	anillo_util.write_if_changed(header, header_contents)
 
-	with io.open(jsonpath, 'w', newline='\n') as jsonfile:
-		json.dump(data, jsonfile, indent='\t')
+	if jsonpath != None:
+		data = {}
 
-if depfile != None:
-	result = subprocess.run([
-		'clang',
-		'-o-',
-		'-ffreestanding',
-		'-nostdlib',
-		'-target',
-		f'{arch}-unknown-darwin-macho',
-		'-M',
-		source,
-		*compiler_args
-	], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=stderr)
-	result.check_returncode()
+		for size in sizes:
+			data[size.struct] = { 'size': size.size, 'layout': {} }
 
-	output = result.stdout.decode('utf-8')
+		for offset in offsets:
+			if not (offset.struct in data):
+				data[offset.struct] = { 'size': None, 'layout': {} }
+
+			data[offset.struct]['layout'][offset.member] = offset.offset
+
+		anillo_util.mkdir_p(os.path.dirname(jsonpath))
 
-	write_depfile = False
+		anillo_util.write_if_changed(jsonpath, json.dumps(data, indent='\t'))
 
-	anillo_util.mkdir_p(os.path.dirname(depfile))
+	if depfile != None:
+		with io.open(depfile + '.tmp', 'r', newline='\n') as infile:
+			anillo_util.write_if_changed(depfile, infile.read())
+		os.remove(depfile + '.tmp')
 
-	if os.path.exists(depfile):
-		with io.open(depfile, 'r', newline='\n') as outfile:
-			file_content = outfile.read().strip()
-			if hashlib.sha256(output.strip().encode()).hexdigest() != hashlib.sha256(file_content.encode()).hexdigest():
-				write_depfile = True
-	else:
-		write_depfile = True
+		# the depfile may have changed, so the key has to be computed after writing it for the next run to match it
+		anillo_util.save_inputs_digest(cache_key_path, command, cache_inputs, depfile)
 
-	if write_depfile:
-		with io.open(depfile, 'w', newline='\n') as outfile:
-			outfile.write(output)
+if __name__ == '__main__':
+	main()